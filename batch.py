@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from excel_dashboard import stock_dashboard_generator
+from financial_data import DATA_URL, TICKERS_URL, SECDataRetriever
+from instrumentation import instrumentation, profile
+from market_data import join_market_data
+from price_store import PriceStore
+from response_cache import ResponseCache
+from screener import Screener
+from sec_requests import RateLimiter, set_rate_limiter
+
+STAGES = ["statements", "market data", "dashboard", "screener"]
+
+# state of each worker process, created once by init_worker and reused for every ticker
+retriever = None
+prices = None
+screener = None
+
+
+def init_worker(email, limiter, cache_directory, prices_directory, offline, screener_directory=None,
+                sec_urls=(TICKERS_URL, DATA_URL)):
+    """Set up a worker process with the shared rate limiter, its own cache connection, retriever and price store,
+    and the screener table to update when there is one."""
+    global retriever, prices, screener
+    set_rate_limiter(limiter)
+    retriever = SECDataRetriever(email, cache=ResponseCache(cache_directory, offline=offline),
+                                 tickers_url=sec_urls[0], data_url=sec_urls[1])
+    prices = PriceStore(prices_directory, offline=offline)
+    screener = Screener(screener_directory) if screener_directory else None
+
+
+def process_ticker(ticker):
+    """Run the whole pipeline for a single ticker in a worker and return its timings, errors and instrumentation."""
+    result = {"ticker": ticker, "timings": {}, "missing tags": [], "dashboard written": False, "error": None}
+    try:
+        start = time.perf_counter()
+        income, balance, cashflow = retriever.financial_statements(ticker)
+        result["missing tags"] = list(retriever.errors)
+        result["timings"]["statements"] = time.perf_counter() - start
+        start = time.perf_counter()
+        income, balance, cashflow = join_market_data(ticker, income, balance, cashflow, prices)
+        result["timings"]["market data"] = time.perf_counter() - start
+        start = time.perf_counter()
+        result["dashboard written"] = stock_dashboard_generator(ticker, income, balance, cashflow)
+        result["timings"]["dashboard"] = time.perf_counter() - start
+        if screener is not None:
+            start = time.perf_counter()
+            screener.update(ticker, income, balance, cashflow)  # only replaces the rows of this ticker
+            result["timings"]["screener"] = time.perf_counter() - start
+    except Exception:
+        result["error"] = traceback.format_exc()
+    # send what was collected since the last ticker of this worker
+    result["instrumentation"] = instrumentation.snapshot()
+    instrumentation.reset()
+    return result
+
+
+def completed_tickers(checkpoint):
+    """Read the tickers which were already completed by a previous run from the checkpoint file."""
+    done = set()
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                if record["error"] is None:
+                    done.add(record["ticker"])
+    return done
+
+
+def summary(results, elapsed):
+    """Create a summary of the throughput, the time spent in each stage and the failures of a batch run."""
+    failures = {result["ticker"]: result["error"].strip().splitlines()[-1] for result in results if result["error"]}
+    lines = ["Processed " + str(len(results)) + " tickers in " + str(round(elapsed, 1)) + "s (" +
+             str(round(len(results) / elapsed, 2) if elapsed else 0) + " tickers/s), " +
+             str(len(failures)) + " failed, " +
+             str(sum(not result["dashboard written"] for result in results if not result["error"])) +
+             " dashboards unchanged."]
+    hit_rate = instrumentation.cache_hit_rate()
+    requests = sum(value for (name, _), value in instrumentation.counters.items() if name == "http_requests_total")
+    throttled = sum(value for (name, _), value in instrumentation.counters.items() if name == "http_throttled_total")
+    lines.append(str(requests) + " http requests, " + str(throttled) + " throttled" +
+                 (", cache hit rate " + str(round(hit_rate * 100, 1)) + "%" if hit_rate is not None else "") + ".")
+    for stage in STAGES:
+        timings = [result["timings"][stage] for result in results if stage in result["timings"]]
+        if timings:
+            lines.append(stage + ": total " + str(round(sum(timings), 1)) + "s, mean " +
+                         str(round(sum(timings) / len(timings), 3)) + "s, max " + str(round(max(timings), 3)) + "s")
+    for ticker, error in failures.items():
+        lines.append(ticker + " failed: " + error)
+    return "\n".join(lines)
+
+
+def run_batch(email, tickers=None, workers=4, checkpoint="batch_checkpoint.jsonl", cache_directory="cache",
+              prices_directory="prices", offline=False, metrics=None, screener_directory=None,
+              sec_urls=(TICKERS_URL, DATA_URL)):
+    """
+    Create the dashboards of the tickers (all tickers of company_tickers.json when None) with a pool of worker processes.
+    The workers share one rate limiter so together they stay under the SEC limit. Every finished ticker is appended
+    to the checkpoint file, and tickers already completed there are skipped so a crashed run resumes where it stopped.
+    The instrumentation of the workers is collected and exported to the metrics file when given,
+    and the fundamentals of every ticker are stored in the screener table when a screener directory is given.
+    """
+    limiter = RateLimiter(shared=True)
+    set_rate_limiter(limiter)
+    if tickers is None:
+        tickers = list(SECDataRetriever(email, cache=ResponseCache(cache_directory, offline=offline),
+                                        tickers_url=sec_urls[0], data_url=sec_urls[1]).tickers_cik.index)
+    done = completed_tickers(checkpoint)
+    remaining = list(dict.fromkeys(ticker for ticker in tickers if ticker not in done))
+    print(str(len(done)) + " tickers already completed, " + str(len(remaining)) + " to go.")
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(email, limiter, cache_directory, prices_directory, offline,
+                                       screener_directory, sec_urls)) as pool, \
+            open(checkpoint, "a") as output:
+        futures = [pool.submit(process_ticker, ticker) for ticker in remaining]
+        for future in as_completed(futures):
+            result = future.result()
+            instrumentation.merge(result.pop("instrumentation"))
+            results.append(result)
+            output.write(json.dumps(result) + "\n")
+            output.flush()  # make sure the checkpoint survives a crash
+    elapsed = time.perf_counter() - start
+    print(summary(results, elapsed))
+    if metrics:
+        instrumentation.export(metrics)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the dashboards of many tickers without interaction.")
+    parser.add_argument("email", help="email to access SEC api")
+    parser.add_argument("tickers", nargs="*", help="tickers to process")
+    parser.add_argument("--tickers-file", help="file with one ticker per line")
+    parser.add_argument("--all", action="store_true", help="process every ticker in company_tickers.json")
+    parser.add_argument("--workers", type=int, default=4, help="number of worker processes")
+    parser.add_argument("--checkpoint", default="batch_checkpoint.jsonl", help="file to record finished tickers")
+    parser.add_argument("--cache", default="cache", help="response cache folder")
+    parser.add_argument("--prices", default="prices", help="price store folder")
+    parser.add_argument("--offline", action="store_true", help="only use the cached responses and stored prices")
+    parser.add_argument("--metrics", help="export the instrumentation, as JSON lines when the file ends with .jsonl "
+                                          "and otherwise in the Prometheus text format")
+    parser.add_argument("--screener", help="folder of the screener table to update with every ticker")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the first ticker in this process with cProfile and tracemalloc instead")
+    args = parser.parse_args()
+    tickers = list(args.tickers)
+    if args.tickers_file:
+        with open(args.tickers_file) as file:
+            tickers += [line.strip() for line in file if line.strip()]
+    if args.all:
+        tickers = None
+    elif not tickers:
+        parser.error("give tickers, a tickers file or --all")
+    if args.profile:
+        init_worker(args.email, RateLimiter(), args.cache, args.prices, args.offline, args.screener)
+        result = profile(process_ticker, (tickers or list(retriever.tickers_cik.index))[0], stats_path="profile.stats")
+        print(result["error"] or "Profile saved to profile.stats")
+        return
+    run_batch(args.email, tickers, args.workers, args.checkpoint, args.cache, args.prices, args.offline, args.metrics,
+              args.screener)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import json
+import os
+
+import numpy as np
+
+from facts_store import TAGS
+
+FIRST_YEAR = 2008
+LAST_YEAR = 2023
+
+
+def synthetic_company(cik, seed, last_year=LAST_YEAR):
+    """Create the companyfacts json of a made up company, with an annual 10-K fact per year up to last_year for every
+    statement tag. The facts of a year carry the accession number of its 10-K in synthetic_submissions."""
+    random = np.random.default_rng(seed)
+    facts = {}
+    for tag, (name, units) in TAGS.items():
+        if random.random() < 0.15:
+            continue  # companies do not report every tag
+        scale = 1.5 if units == "USD/shares" else float(random.integers(10, 10000)) * 10 ** 6
+        growth = np.cumprod(1 + random.normal(0.05, 0.1, last_year - FIRST_YEAR + 1))
+        records = []
+        for year, value in zip(range(FIRST_YEAR, last_year + 1), growth * scale):
+            # balance sheet and share counts are instants, the other tags are durations
+            frame = "CY" + str(year) + ("Q4I" if tag in ("CommonStockSharesOutstanding",) or "Assets" in tag or
+                                        "Liabilities" in tag or "Debt" in tag else "")
+            records.append({"end": str(year) + "-12-31", "val": round(float(value), 2),
+                            "accn": str(cik).zfill(10) + "-" + str(year + 1)[2:] + "-000001",
+                            "fy": year, "fp": "FY", "form": "10-K", "filed": str(year + 1) + "-02-15",
+                            "frame": frame})
+        facts[tag] = {"label": name, "units": {units: records}}
+    return {"cik": cik, "entityName": "Synthetic " + str(cik), "facts": {"us-gaap": facts}}
+
+
+def synthetic_submissions(cik, last_year=LAST_YEAR):
+    """Create the submissions json of a made up company, with a 10-K and a 10-Q per year up to last_year,
+    most recent first like the SEC lists them."""
+    recent = {"form": [], "accessionNumber": [], "filingDate": []}
+    for year in range(last_year, FIRST_YEAR - 1, -1):
+        for form, number, filed in (("10-Q", 2, str(year) + "-08-05"), ("10-K", 1, str(year + 1) + "-02-15")):
+            recent["form"].append(form)
+            recent["accessionNumber"].append(str(cik).zfill(10) + "-" + str(year + 1)[2:] + "-" + str(number).zfill(6))
+            recent["filingDate"].append(filed)
+    return {"cik": str(cik), "name": "Synthetic " + str(cik), "filings": {"recent": recent}}
+
+
+def synthetic_prices(seed):
+    """Create a csv of made up monthly closing prices."""
+    random = np.random.default_rng(seed)
+    months = (LAST_YEAR - FIRST_YEAR + 2) * 12
+    closes = 20 * np.cumprod(1 + random.normal(0.005, 0.05, months))
+    lines = ["Date,Close"]
+    for month, close in enumerate(closes):
+        lines.append(str(FIRST_YEAR + month // 12) + "-" + str(month % 12 + 1).zfill(2) + "-01," +
+                     str(round(float(close), 2)))
+    return ("\n".join(lines) + "\n").encode()
+
+
+class SyntheticFixtures:
+    """
+    The responses of the stand-in server for a number of made up tickers, looked up by path like a dictionary.
+    The bodies are generated when requested, so thousands of tickers do not have to be held in memory.
+    """
+    def __init__(self, tickers):
+        self.tickers = tickers
+
+    def company_tickers(self):
+        company_tickers = {}
+        for number in range(self.tickers):
+            company_tickers[str(number)] = {"cik_str": 1000000 + number, "ticker": "T" + str(number).zfill(5),
+                                            "title": "Synthetic " + str(1000000 + number)}
+        return json.dumps(company_tickers).encode()
+
+    def get(self, path, default=None):
+        """Return the body of the path, or default when there is none."""
+        if path == "/files/company_tickers.json":
+            return self.company_tickers()
+        if path.startswith("/api/xbrl/companyfacts/CIK") and path.endswith(".json"):
+            number = int(path[len("/api/xbrl/companyfacts/CIK"):-len(".json")]) - 1000000
+            if 0 <= number < self.tickers:
+                return json.dumps(synthetic_company(1000000 + number, number)).encode()
+        if path.startswith("/submissions/CIK") and path.endswith(".json"):
+            number = int(path[len("/submissions/CIK"):-len(".json")]) - 1000000
+            if 0 <= number < self.tickers:
+                return json.dumps(synthetic_submissions(1000000 + number)).encode()
+        if path.startswith("/prices/T") and path.endswith(".csv"):
+            number = int(path[len("/prices/T"):-len(".csv")])
+            if 0 <= number < self.tickers:
+                return synthetic_prices(number)
+        return default
+
+
+def recorded_fixtures(directory):
+    """Load recorded responses from a directory which mirrors the server paths, e.g.
+    files/company_tickers.json, api/xbrl/companyfacts/CIK0000320193.json, submissions/CIK0000320193.json
+    and prices/AAPL.csv."""
+    fixtures = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            with open(path, "rb") as file:
+                fixtures["/" + os.path.relpath(path, directory).replace(os.sep, "/")] = file.read()
+    return fixtures
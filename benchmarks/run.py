@@ -0,0 +1,164 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.fixtures import SyntheticFixtures, recorded_fixtures
+from benchmarks.server import StandInPriceSource, StandInServer
+from excel_dashboard import DashboardWriter
+from financial_data import SECDataRetriever
+from market_data import join_market_data
+from price_store import PriceStore
+from sec_requests import RateLimiter, set_rate_limiter
+
+STAGES = ["ticker mapping", "tag fetch", "merge", "derived metrics", "market join", "excel write"]
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+class StageTimer:
+    """Adds up the time spent in each stage, also for functions which are called from within other stages."""
+    def __init__(self):
+        self.timings = dict.fromkeys(STAGES, 0.0)
+        self.running = []  # stages currently timed, a nested stage is taken off the time of the stage around it
+
+    def wrap(self, stage, function):
+        """Return the function timed as part of the stage."""
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            self.running.append(0.0)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = self.running.pop()
+                self.timings[stage] += elapsed - nested
+                if self.running:
+                    self.running[-1] += elapsed
+        return timed
+
+
+def run_size(url, tickers, directory, rate, company_facts=True):
+    """Run the pipeline over the first tickers of the stand-in server and time each stage.
+    Meant to run in a fresh process, so the peak memory of the process is the peak memory of this run.
+    Returns the seconds spent per stage and the peak memory."""
+    set_rate_limiter(RateLimiter(rate=rate))
+    timer = StageTimer()
+    retriever = timer.wrap("ticker mapping", SECDataRetriever)(
+        "benchmark@example.com", company_facts=company_facts,
+        tickers_url=url + "/files/company_tickers.json", data_url=url)
+    retriever.load_company_facts = timer.wrap("tag fetch", retriever.load_company_facts)
+    retriever.prefetch = timer.wrap("tag fetch", retriever.prefetch)
+    retriever.merge_records = timer.wrap("merge", retriever.merge_records)
+    retriever.other_statistics = timer.wrap("merge", retriever.other_statistics)
+    # what is left of the calculators and of combining the statements after fetching and merging are the metrics
+    for method in ["income_statement_calculator", "balance_sheet_calculator", "cashflow_calculator",
+                   "financial_statements"]:
+        setattr(retriever, method, timer.wrap("derived metrics", getattr(retriever, method)))
+    prices = PriceStore(os.path.join(directory, "prices"), StandInPriceSource(url), max_age=0)
+    writer = DashboardWriter(os.path.join(directory, "dashboards"), skip_unchanged=False)
+    os.makedirs(writer.directory, exist_ok=True)
+    join = timer.wrap("market join", join_market_data)
+    write = timer.wrap("excel write", writer.write)
+    for ticker in retriever.tickers_cik.index[:tickers]:
+        income, balance, cashflow = retriever.financial_statements(ticker)
+        income, balance, cashflow = join(ticker, income, balance, cashflow, prices)
+        write(ticker, income, balance, cashflow)
+    result = {stage: round(seconds, 4) for stage, seconds in timer.timings.items()}
+    result["peak memory (MB)"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # KB on linux
+    return result
+
+
+def machine():
+    """Describe the machine the benchmark runs on, stored with the baseline."""
+    return {"platform": platform.platform(), "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(), "python": platform.python_version()}
+
+
+def shares(result):
+    """The share of each per-ticker stage in the time spent over those stages, which can be compared across machines.
+    The ticker mapping is left out, it is done once per run."""
+    stages = STAGES[1:]
+    total = sum(result.get(stage, 0) for stage in stages)
+    return {stage + " (share)": result[stage] / total for stage in stages if stage in result and total}
+
+
+def regressions(results, baseline, tolerance, noise=0.05, same_machine=True):
+    """Compare the results with the baseline. A measurement is flagged when it is more than tolerance
+    (a fraction) above its baseline, ignoring differences below the noise floor. When the baseline was recorded
+    on another machine the seconds are not comparable, and the share of each stage in the total is compared instead."""
+    flagged = []
+    for size, result in results.items():
+        reference = baseline.get(size, {})
+        if not same_machine:
+            result = {**shares(result), "peak memory (MB)": result["peak memory (MB)"]}
+            reference = {**shares(reference), "peak memory (MB)": reference.get("peak memory (MB)")}
+        for measure, value in result.items():
+            if reference.get(measure) is None:
+                continue
+            floor = 1 if measure == "peak memory (MB)" else noise
+            if value > reference[measure] * (1 + tolerance) and value - reference[measure] > floor:
+                flagged.append(size + " tickers, " + measure + ": " + str(round(value, 4)) + " vs baseline " +
+                               str(round(reference[measure], 4)))
+    return flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline against a local stand-in for the SEC api "
+                                                 "and the price source.")
+    parser.add_argument("--sizes", default="1,100,5000", help="comma separated numbers of tickers to run")
+    parser.add_argument("--fixtures", help="directory of recorded responses instead of synthetic tickers")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--throttle", type=int, help="requests per second after which the server answers 429")
+    parser.add_argument("--rate", type=float, default=1000, help="requests per second of the client rate limiter")
+    parser.add_argument("--companyconcept", action="store_true", help="request each tag separately")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before flagging")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    fixtures = recorded_fixtures(args.fixtures) if args.fixtures else SyntheticFixtures(max(sizes))
+    results = {}
+    with StandInServer(fixtures, args.latency, args.throttle) as server, \
+            tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            # every size runs in a fresh process so their peak memory can be told apart
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results[str(size)] = pool.submit(run_size, server.url, size, os.path.join(directory, str(size)),
+                                                 args.rate, not args.companyconcept).result()
+            print(str(size) + " tickers: " + json.dumps(results[str(size)]))
+        print("Requests: " + str(server.requests) + ", throttled: " + str(server.throttled))
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump({"machine": machine(), "results": results}, file, indent=4)
+            file.write("\n")
+        print("Baseline saved to " + args.baseline)
+        return
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare with, save one with --save-baseline.")
+        return
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    same_machine = baseline["machine"] == machine()
+    if not same_machine:
+        print("The baseline was recorded on another machine (" + baseline["machine"]["processor"] + ", " +
+              str(baseline["machine"]["cpus"]) + " cpus), comparing the share of each stage instead of seconds.")
+    missing = [str(size) for size in sizes if str(size) not in baseline["results"]]
+    if missing:
+        print("No baseline for " + ", ".join(missing) + " tickers.")
+    flagged = regressions(results, baseline["results"], args.tolerance, noise=0.05 if same_machine else 0.02,
+                          same_machine=same_machine)
+    for line in flagged:
+        print("Regression: " + line)
+    if flagged:
+        sys.exit(1)
+    print("No regressions against " + args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+import pandas as pd
+import requests
+
+from price_store import PriceSource, month_keys
+
+
+class StandInServer:
+    """
+    A local HTTP server standing in for the SEC api and the price source, replaying fixtures
+    (a dictionary of path to body, or anything else with a get method like SyntheticFixtures).
+    Every response is delayed by latency seconds, and more than requests_per_second requests within a second
+    are answered with 429 like the SEC does. companyconcept responses are derived from the companyfacts fixtures.
+    """
+    def __init__(self, fixtures, latency=0.0, requests_per_second=None):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.requests_per_second = requests_per_second
+        self.requests = 0
+        self.throttled = 0
+        self.recent = deque()  # times of the requests within the last second
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:" + str(self.server.server_address[1])
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def throttle(self):
+        """Count the request and check if it is over the rate limit."""
+        with self.lock:
+            self.requests += 1
+            if self.requests_per_second is None:
+                return False
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] > 1:
+                self.recent.popleft()
+            if len(self.recent) >= self.requests_per_second:
+                self.throttled += 1
+                return True
+            self.recent.append(now)
+            return False
+
+    def body(self, path):
+        """Return the fixture of the path, or None when there is none."""
+        body = self.fixtures.get(path)
+        if body is not None:
+            return body
+        if path.startswith("/api/xbrl/companyconcept/"):
+            # /api/xbrl/companyconcept/CIK##########/us-gaap/<tag>.json
+            cik, _, tag = path[len("/api/xbrl/companyconcept/"):-len(".json")].split("/")
+            facts = self.fixtures.get("/api/xbrl/companyfacts/" + cik + ".json")
+            if facts is not None:
+                concept = json.loads(facts)["facts"].get("us-gaap", {}).get(tag)
+                if concept is not None:
+                    return json.dumps(concept).encode()
+        return None
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep connections alive like the SEC does
+
+            def do_GET(self):
+                time.sleep(server.latency)
+                if server.throttle():
+                    self.send_response(429)
+                    self.send_header("Retry-After", "1")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = server.body(self.path.split("?")[0])
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # keep the benchmark output readable
+
+        return Handler
+
+
+class StandInPriceSource(PriceSource):
+    """Monthly closes served by the stand-in server as <url>/prices/<ticker>.csv."""
+    def __init__(self, url):
+        self.url = url
+        self.session = requests.Session()
+
+    def monthly_closes(self, ticker, start=None):
+        response = self.session.get(self.url + "/prices/" + ticker + ".csv")
+        response.raise_for_status()
+        hist = pd.read_csv(StringIO(response.text))
+        if start is not None:
+            hist = hist.loc[month_keys(hist['Date']) >= month_keys(pd.Series([start]))[0]]
+        return hist[['Date', 'Close']]
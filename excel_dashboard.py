@@ -1,4 +1,11 @@
+import hashlib
+import os
+
+import numpy as np
 import pandas as pd
+import xlsxwriter
+
+from instrumentation import instrumentation
 
 
 def reorder_columns(df, type):
@@ -23,56 +30,109 @@ def reorder_columns(df, type):
     return df.transpose()  # transpose to have year on the horizontal
 
 
-def stock_dashboard_generator(ticker, income, balance, cashflow):
-    # Reorder the columns
-    income = reorder_columns(income, "Income Statement")
-    balance = reorder_columns(balance, "Balance Sheet")
-    cashflow = reorder_columns(cashflow, "Cashflow Statement")
-    # separate the statistics into subjective lists of positive, neutral, and negative for the conditional formatting
-    positive = ['Revenue', 'Revenue Avg3', 'Gross Profit', 'EBIT', 'EBITDA',
-                'Net Income', 'Gross Margin(%)', 'R&D Margin(%)', 'EBIT Margin(%)', 'EBITDA Margin(%)',
-                'Net Income Margin(%)', 'Basic EPS', 'Diluted EPS',
-                # balance sheet
-                'Cash', 'Inventory', 'Current Assets', 'Non-Current Assets', 'Assets', 'DeferredRevenueCurrent',
-                'Stockholders Equity(BV)', 'BV/Share', 'Tangible BV',
-                # cashflow
-                'CFO', 'CFO Avg3', 'CFI', 'Dividends', 'Debt Repayment', 'Common Stock Repurchased',
-                'NCF', 'FCF', 'CFO Margin(%)', 'NCF Margin(%)', 'FCF Margin(%)']
-    neutral = ['Period End', 'Price', 'Outstanding Shares', 'Market Cap', 'COGS', 'R&D', 'SGA', 'D&A',
-               'CapEx']
-    negative = ['Operating expense', 'Interest Expense', 'Tax Expense', 'SGA Margin(%)',
-                'DebtCurrent', 'AccountsPayableCurrent', 'Current Liabilities', 'Long-term Debt',
-                'Non Current Liabilities', 'Liabilities',
-                'CFF']
-    # Create a Pandas Excel writer using XlsxWriter as the engine.
-    writer = pd.ExcelWriter("dashboards//" + ticker + ".xlsx", engine="xlsxwriter")
-    # create a dictionary of the financial statement to its dataframe to loop through
-    df_to_fs = {"Income Statement": income,
-                "Balance Sheet": balance,
-                "Cashflow Statement": cashflow}
-    # loop through each financial statement to create a separate sheet for each one
-    for financial_sheet, df in df_to_fs.items():
-        # Convert the dataframe to an XlsxWriter Excel object.
-        df.to_excel(writer, sheet_name=financial_sheet)
-        # Get the xlsxwriter workbook and worksheet objects.
-        workbook = writer.book
-        worksheet = writer.sheets[financial_sheet]
-        # Get the dimensions of the dataframe.
+# separate the statistics into subjective sets of positive, neutral, and negative for the conditional formatting
+POSITIVE = {'Revenue', 'Revenue Avg3', 'Gross Profit', 'EBIT', 'EBITDA',
+            'Net Income', 'Gross Margin(%)', 'R&D Margin(%)', 'EBIT Margin(%)', 'EBITDA Margin(%)',
+            'Net Income Margin(%)', 'Basic EPS', 'Diluted EPS',
+            # balance sheet
+            'Cash', 'Inventory', 'Current Assets', 'Non-Current Assets', 'Assets', 'DeferredRevenueCurrent',
+            'Stockholders Equity(BV)', 'BV/Share', 'Tangible BV',
+            # cashflow
+            'CFO', 'CFO Avg3', 'CFI', 'Dividends', 'Debt Repayment', 'Common Stock Repurchased',
+            'NCF', 'FCF', 'CFO Margin(%)', 'NCF Margin(%)', 'FCF Margin(%)'}
+NEUTRAL = {'Period End', 'Price', 'Outstanding Shares', 'Market Cap', 'COGS', 'R&D', 'SGA', 'D&A',
+           'CapEx'}
+NEGATIVE = {'Operating expense', 'Interest Expense', 'Tax Expense', 'SGA Margin(%)',
+            'DebtCurrent', 'AccountsPayableCurrent', 'Current Liabilities', 'Long-term Debt',
+            'Non Current Liabilities', 'Liabilities',
+            'CFF'}
+# the 3 color scales of positive and negative statistics, each row is scaled on its own
+POSITIVE_SCALE = {"type": "3_color_scale", 'min_color': "red", 'mid_color': "white", 'max_color': "green"}
+NEGATIVE_SCALE = {"type": "3_color_scale", 'min_color': "green", 'mid_color': "white", 'max_color': "red"}
+STATEMENTS = ["Income Statement", "Balance Sheet", "Cashflow Statement"]
+
+
+def content_hash(frames):
+    """Hash the content of the dataframes, including their row and column labels."""
+    digest = hashlib.sha256()
+    for df in frames:
+        digest.update(repr((list(df.index), list(df.columns))).encode())
+        digest.update(pd.util.hash_pandas_object(df.astype(str), index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+class DashboardWriter:
+    """
+    Writes the dashboards of tickers, either a workbook per ticker or many tickers into a single workbook with
+    a sheet per ticker and statement. The rows are streamed with xlsxwriter's constant memory mode,
+    and a workbook is not written again when the content hash of its dataframes matches the last written file.
+    """
+    def __init__(self, directory="dashboards", constant_memory=True, skip_unchanged=True):
+        self.directory = directory
+        self.constant_memory = constant_memory
+        self.skip_unchanged = skip_unchanged
+
+    def unchanged(self, path, digest):
+        """Check if the workbook exists and was written from dataframes with the same hash."""
+        if not self.skip_unchanged or not os.path.exists(path) or not os.path.exists(path + ".sha256"):
+            return False
+        with open(path + ".sha256") as file:
+            return file.read().strip() == digest
+
+    def write_sheet(self, workbook, sheet_name, df):
+        """Write a reordered (transposed) statement to a new sheet, a row per statistic."""
+        worksheet = workbook.add_worksheet(sheet_name)
         (max_row, max_col) = df.shape
-        # loop through each row to determine the type of conditional formatting applied to it
-        statistics = list(df.index)
-        for row in range(max_row):
-            if statistics[row] in positive:
-                worksheet.conditional_format(row + 1, 1, row + 1, max_col, {"type": "3_color_scale",
-                                                                            'min_color': "red",
-                                                                            'mid_color': "white",
-                                                                            'max_color': "green"})
-            if statistics[row] in negative:
-                worksheet.conditional_format(row + 1, 1, row + 1, max_col, {"type": "3_color_scale",
-                                                                            'min_color': "green",
-                                                                            'mid_color': "white",
-                                                                            'max_color': "red"})
-        column_length = df.index.astype(str).map(len).max()  # find the max length for the strings in the first column
-        writer.sheets[financial_sheet].set_column(0, 0, column_length)  # extend the column to this max length
-        worksheet.freeze_panes(0, 1)  # Freeze the first row when you are scrolling in Excel
-    writer.close()  # Close the Pandas Excel writer and output the Excel file.
+        column_length = df.index.astype(str).map(len).max() if max_row else 0  # the max length of the statistics
+        worksheet.set_column(0, 0, column_length)  # extend the first column to this max length
+        worksheet.freeze_panes(0, 1)  # Freeze the first column when you are scrolling in Excel
+        # rows have to be written in order in constant memory mode, starting with the years
+        worksheet.write_row(0, 1, [str(year) for year in df.columns])
+        # xlsxwriter can not write nan or inf as numbers, leave those cells empty (e.g. margins of zero revenue)
+        df = df.replace([np.inf, -np.inf], np.nan)
+        values = df.astype(object).where(df.notna(), None).values.tolist()
+        for row, (statistic, cells) in enumerate(zip(df.index, values), start=1):
+            worksheet.write(row, 0, statistic)
+            worksheet.write_row(row, 1, cells)
+            # determine the type of conditional formatting applied to the row
+            if statistic in POSITIVE:
+                worksheet.conditional_format(row, 1, row, max_col, POSITIVE_SCALE)
+            elif statistic in NEGATIVE:
+                worksheet.conditional_format(row, 1, row, max_col, NEGATIVE_SCALE)
+
+    @instrumentation.timed("dashboard", "path")
+    def write_workbook(self, path, sheets):
+        """Write the sheets ({sheet name: reordered dataframe}) to the workbook, unless it has not changed.
+        Returns whether the workbook was written."""
+        digest = content_hash([pd.DataFrame(list(sheets))] + list(sheets.values()))
+        if self.unchanged(path, digest):
+            instrumentation.count("dashboards_total", result="unchanged")
+            return False
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": self.constant_memory})
+        for sheet_name, df in sheets.items():
+            self.write_sheet(workbook, sheet_name, df)
+        workbook.close()
+        with open(path + ".sha256", "w") as file:
+            file.write(digest)
+        instrumentation.count("dashboards_total", result="written")
+        return True
+
+    def write(self, ticker, income, balance, cashflow):
+        """Write the dashboard of a ticker to its own workbook with a sheet per financial statement."""
+        sheets = {statement: reorder_columns(df, statement)
+                  for statement, df in zip(STATEMENTS, [income, balance, cashflow])}
+        return self.write_workbook(os.path.join(self.directory, ticker + ".xlsx"), sheets)
+
+    def write_many(self, name, statements):
+        """Write the dashboards of many tickers ({ticker: (income, balance, cashflow)}) into a single workbook,
+        with a sheet per ticker and financial statement."""
+        sheets = {}
+        for ticker, frames in statements.items():
+            for statement, df in zip(STATEMENTS, frames):
+                sheets[(ticker + " " + statement)[:31]] = reorder_columns(df, statement)  # excel allows 31 characters
+        return self.write_workbook(os.path.join(self.directory, name + ".xlsx"), sheets)
+
+
+def stock_dashboard_generator(ticker, income, balance, cashflow):
+    """Save the dashboard of the ticker in the dashboards folder, returns whether the workbook was written."""
+    return DashboardWriter().write(ticker, income, balance, cashflow)
@@ -0,0 +1,90 @@
+import argparse
+import json
+import sqlite3
+import zipfile
+
+from financial_data import BALANCE_SHEET_TAGS, CASHFLOW_TAGS, INCOME_STATEMENT_TAGS, OTHER_TAGS
+
+# the us-gaap tags used by the financial statements, all other facts are left out of the store
+TAGS = {**INCOME_STATEMENT_TAGS, **BALANCE_SHEET_TAGS, **CASHFLOW_TAGS, **OTHER_TAGS}
+FIELDS = ["end", "val", "accn", "fy", "fp", "form", "filed", "frame"]
+
+
+class FactsStore:
+    """
+    A local sqlite store of the us-gaap facts of every company, filled from the nightly companyfacts.zip
+    archive of the SEC (https://www.sec.gov/Archives/edgar/daily-index/xbrl/companyfacts.zip).
+    The facts are indexed by cik, tag and period end so the facts of a company can be read without the SEC api.
+    """
+    def __init__(self, path="facts.sqlite"):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS companies (cik TEXT PRIMARY KEY, name TEXT)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS facts (cik TEXT, tag TEXT, unit TEXT, end TEXT, val REAL, "
+                                "accn TEXT, fy INTEGER, fp TEXT, form TEXT, filed TEXT, frame TEXT)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS facts_cik_tag_end ON facts (cik, tag, end)")
+        self.connection.commit()
+
+    def ingest(self, archive_path, commit_every=500):
+        """
+        Read the companyfacts archive member by member without extracting it, and replace the stored facts of
+        each company in it. Only one company is held in memory at a time. Returns the number of companies ingested.
+        """
+        self.connection.execute("PRAGMA synchronous=OFF")  # the archive can be ingested again after a crash
+        companies = 0
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.filename.endswith(".json"):
+                    continue
+                with archive.open(info) as member:
+                    try:
+                        company = json.load(member)
+                    except ValueError:
+                        continue  # skip damaged members instead of failing the whole archive
+                if "cik" not in company:
+                    continue
+                self.ingest_company(company)
+                companies += 1
+                if companies % commit_every == 0:
+                    self.connection.commit()
+        self.connection.commit()
+        self.connection.execute("PRAGMA synchronous=FULL")
+        return companies
+
+    def ingest_company(self, company):
+        """Normalize the facts json of a single company into rows and replace its stored facts with them."""
+        cik = str(company["cik"]).zfill(10)
+        facts = company.get("facts", {}).get("us-gaap", {})
+        rows = [(cik, tag, unit, *[record.get(field) for field in FIELDS])
+                for tag in TAGS if tag in facts
+                for unit, records in facts[tag]["units"].items()
+                for record in records]
+        self.connection.execute("INSERT OR REPLACE INTO companies VALUES (?, ?)", (cik, company.get("entityName")))
+        self.connection.execute("DELETE FROM facts WHERE cik = ?", (cik,))
+        self.connection.executemany("INSERT INTO facts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def company_facts(self, cik):
+        """Return the stored facts of a company in the layout of the companyfacts api ({tag: {'units': {unit: [...]}}}),
+        so it can be used in place of a download. Raises KeyError when the company is not in the store."""
+        if self.connection.execute("SELECT 1 FROM companies WHERE cik = ?", (cik,)).fetchone() is None:
+            raise KeyError(cik)
+        facts = {}
+        for tag, unit, *values in self.connection.execute("SELECT tag, unit, " + ", ".join(FIELDS) +
+                                                          " FROM facts WHERE cik = ? ORDER BY tag, end", (cik,)):
+            record = {field: value for field, value in zip(FIELDS, values) if value is not None}
+            facts.setdefault(tag, {"units": {}})["units"].setdefault(unit, []).append(record)
+        return facts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest the SEC companyfacts.zip archive into a local facts store.")
+    parser.add_argument("archive", help="path of companyfacts.zip")
+    parser.add_argument("--database", default="facts.sqlite", help="path of the sqlite store")
+    args = parser.parse_args()
+    companies = FactsStore(args.database).ingest(args.archive)
+    print("Ingested " + str(companies) + " companies into " + args.database)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,57 @@
-import requests
+import time
+
 import pandas as pd
 
+from instrumentation import instrumentation
+from metrics import METRICS, compute_metrics
+from sec_requests import SECSession
+
+# SEC endpoints, can be replaced e.g. by a local stand-in server
+TICKERS_URL = "https://www.sec.gov/files/company_tickers.json"
+DATA_URL = "https://data.sec.gov"
+
+# income statement tags
+INCOME_STATEMENT_TAGS = {"Revenues": ['Revenue', "USD"],
+                         "CostOfGoodsAndServicesSold": ['COGS', "USD"],
+                         "GrossProfit": ['Gross Profit', "USD"],
+                         "ResearchAndDevelopmentExpense": ['R&D', "USD"],
+                         "SellingGeneralAndAdministrativeExpense": ['SGA', "USD"],
+                         "DepreciationDepletionAndAmortization": ['D&A', "USD"],
+                         "InterestExpense": ['Interest Expense', "USD"],
+                         "DirectTaxesAndLicensesCosts": ['Tax', "USD"],
+                         "EarningsPerShareBasic": ['Basic EPS', "USD/shares"],
+                         "EarningsPerShareDiluted": ['Diluted EPS', "USD/shares"],
+                         "NetIncomeLoss": ['Net Income', "USD"]}
+
+# balance sheet tags
+BALANCE_SHEET_TAGS = {"CashAndCashEquivalentsAtCarryingValue": ['Cash', "USD"],
+                      "InventoryNet": ['Inventory', "USD"],
+                      "AssetsCurrent": ['Current Assets', "USD"],
+                      "AssetsNoncurrent": ['Non-Current Assets', "USD"],
+                      "DebtCurrent": ['Current Debt', "USD"],
+                      "AccountsPayableCurrent": ['Accounts Payable', "USD"],
+                      "DeferredRevenueCurrent": ['Deferred Revenue', "USD"],
+                      "LiabilitiesCurrent": ['Current Liabilities', "USD"],
+                      "LongTermDebt": ['Long-term Debt', "USD"],
+                      "LiabilitiesNoncurrent": ['Non Current Liabilities', "USD"],
+                      "Liabilities": ['Liabilities', "USD"],
+                      "IntangibleAssetsNetExcludingGoodwill": ['Intangible Assets', "USD"],
+                      "Goodwill": ['Goodwill', "USD"],
+                      }
+
+# cashflow tags
+CASHFLOW_TAGS = {"NetCashProvidedByUsedInOperatingActivities": ['CFO', "USD"],
+                 "NetCashProvidedByUsedInInvestingActivities": ['CFI', "USD"],
+                 "NetCashProvidedByUsedInFinancingActivities": ['CFF', "USD"],
+                 "PaymentsOfDividends": ['Dividends', "USD"],
+                 "RepaymentsOfDebt": ["Debt Repayment", "USD"],
+                 "PaymentsForRepurchaseOfCommonStock": ["Common Stock Repurchased", "USD"],
+                 "PaymentsToAcquirePropertyPlantAndEquipment": ['CapEx', "USD"],
+                 }
+
+# other key information
+OTHER_TAGS = {"CommonStockSharesOutstanding": ['Outstanding Shares', "shares"]}
+
 
 class SECDataRetriever:
     """
@@ -8,18 +59,29 @@ class SECDataRetriever:
     API documentation found at https://www.sec.gov/edgar/sec-api-documentation.
     Use https://xbrlsite.azurewebsites.net/2019/Prototype/references/us-gaap/ to find relevant tags.
     All USD values and shares recalculated here per million.
+    By default every tag of a company is served from a single companyfacts download, set company_facts to False
+    to request each tag separately through the companyconcept endpoint instead.
+    Pass a ResponseCache to keep the responses on disk between runs,
+    or a FactsStore to read the facts from a local store filled from the companyfacts.zip archive.
     """
-    def __init__(self, email):
-        self.header = {'User-Agent': email}  # email required to use sec api
-        self.company_tickers = requests.get("https://www.sec.gov/files/company_tickers.json", headers=self.header)
+    def __init__(self, email, company_facts=True, cache=None, store=None, tickers_url=TICKERS_URL, data_url=DATA_URL):
+        self.session = SECSession(email, cache=cache)  # pooled and rate limited, email required to use sec api
+        self.data_url = data_url
+        self.company_tickers = self.session.get_json(tickers_url)
+        self.company_facts = company_facts
+        self.store = store
+        self.facts = None
+        self.concepts = {}  # companyconcept responses (or the error raised) per tag
+        self.errors = {}  # tags which could not be retrieved with the reason
         self.tickers_cik = None
         self.ticker = None
         self.cik = None
         self.ticker_mapping()
 
+    @instrumentation.timed("ticker_mapping")
     def ticker_mapping(self):
         """Use the company ticker to cik mapping provided by the SEC api and create a dataframe with it."""
-        self.tickers_cik = pd.json_normalize(pd.json_normalize(self.company_tickers.json(), max_level=0).values[0])
+        self.tickers_cik = pd.json_normalize(pd.json_normalize(self.company_tickers, max_level=0).values[0])
         self.tickers_cik["cik_str"] = self.tickers_cik["cik_str"].astype(str).str.zfill(10)
         self.tickers_cik.set_index("ticker", inplace=True)
 
@@ -27,153 +89,136 @@ class SECDataRetriever:
         """Set the ticker attribute, and it's matching cik value using the mapping."""
         self.ticker = ticker
         self.cik = self.tickers_cik.loc[self.tickers_cik.index == self.ticker, "cik_str"].item()
+        # facts, concepts and errors belong to the previous company
+        self.facts = None
+        self.concepts = {}
+        self.errors = {}
+        if self.store is not None:
+            self.facts = self.store.company_facts(self.cik)
+        elif self.company_facts:
+            self.load_company_facts()
+
+    def load_company_facts(self):
+        """Request every us-gaap fact of the company at once, so the tags can be looked up without further requests."""
+        facts = self.session.get_json(self.data_url+"/api/xbrl/companyfacts/CIK"+self.cik+".json")
+        self.facts = facts["facts"].get("us-gaap", {})
+
+    def concept_url(self, tag):
+        """The companyconcept endpoint of the tag for the current company."""
+        return self.data_url+"/api/xbrl/companyconcept/CIK"+self.cik+"/us-gaap/"+tag+".json"
+
+    def prefetch(self, tags):
+        """Request the tags which have not been retrieved yet concurrently from the companyconcept endpoint.
+        Not needed when the company facts are loaded."""
+        if self.facts is not None:
+            return
+        urls = {self.concept_url(tag): tag for tag in tags if tag not in self.concepts}
+        for url, result in self.session.fetch_many(urls).items():
+            self.concepts[urls[url]] = result
+
+    def concept(self, tag):
+        """Return the json of a single tag, either from the loaded company facts or from the companyconcept endpoint.
+        Both have the same layout, with the values grouped per unit under 'units'."""
+        if self.facts is not None:
+            return self.facts[tag]
+        self.prefetch([tag])
+        result = self.concepts[tag]
+        if isinstance(result, Exception):
+            raise result
+        return result
 
     def tag_data(self, tag, name, units):
         """Request the data matching the tag from the SEC api, and transform this json into a dataframe.
         Keep only the latest filed annual forms (10K, 10K/A, 8K)."""
-        response = requests.get("https://data.sec.gov/api/xbrl/companyconcept/CIK"+self.cik+"/us-gaap/"+tag+".json",
-                                headers=self.header)
-        data = pd.json_normalize(response.json()["units"][units])
+        start = time.perf_counter()
+        data = pd.json_normalize(self.concept(tag)["units"][units])
         # choose the forms to get data from (10k = annual, 10q = quarterly)
         data = data.loc[data.form.isin(["10-K", '10-K/A', '8-K'])]
         data = data.loc[(data.frame.str.len() == 6) | (data.frame.str.len() == 9)]  # Frame either CY#### or CY####Q#I
         data = data.rename(columns={'val': name, 'end': 'Period End'})
         if units != "USD/shares":
             data[name] = data[name]/(10**6)   # want data in USD/million for easier analysis
+        # the request itself is timed by the session (http_request_seconds with the tag label)
+        instrumentation.observe("tag_parse_seconds", time.perf_counter() - start, tag=tag)
         return data
 
     def merge_records(self, tags):
-        """Merge the different dataframes retrieved from the SEC api on the period end column."""
-        records = pd.DataFrame({"Period End": []})
-        columns = ["Period End"]
+        """Combine the dataframes retrieved from the SEC api into a single statement with a row per period end.
+        The records of all tags are stacked in long format and pivoted at once, keeping every period any tag reports.
+        The Source column lists the filing (accn and filed date) each value of the period was taken from."""
+        self.prefetch(tags)  # request all the tags at once instead of one after another
+        records = []
         # loop through each tag to get the relevant data
         for tag, info in tags.items():
             # use try statement to avoid errors in case the data does not exist
             try:
                 column_name = info[0]
                 units = info[1]
-                # get each record
+                # get each record and keep it in long format
                 data = self.tag_data(tag, column_name, units)
-                columns.append(column_name)
-                # join on whichever has more data
-                if len(records) > len(data):
-                    join = "left"
-                else:
-                    join = "right"
-                # want to merge on period end and keep only the relevant columns
-                records = records.merge(data, left_on='Period End', right_on='Period End', how=join)[columns]
-            except:
-                print(tag+" Failed!")
-        return records
-
+                records.append(pd.DataFrame({"Period End": data["Period End"], "Column": column_name,
+                                             "Value": data[column_name], "accn": data["accn"],
+                                             "filed": data["filed"]}))
+            except Exception as error:
+                self.errors[tag] = repr(error)  # keep track of the tags which could not be retrieved
+                instrumentation.count("missing_tags_total", tag=tag)
+        records = [data for data in records if len(data)]
+        if not records:
+            return pd.DataFrame({"Period End": []})
+        records = pd.concat(records, ignore_index=True)
+        # when a period is reported more than once keep the value of the latest filing
+        records = records.sort_values("filed", kind="stable").drop_duplicates(["Period End", "Column"], keep="last")
+        # pivot into a column per tag, in the order of the tags
+        statement = records.pivot(index="Period End", columns="Column", values="Value")
+        columns = [info[0] for info in tags.values() if info[0] in statement.columns]
+        statement = statement[columns]
+        # record which filing each value came from
+        records["Source"] = records["Column"] + ": " + records["accn"] + " (" + records["filed"] + ")"
+        statement["Source"] = records.groupby("Period End")["Source"].agg("; ".join)
+        statement = statement.reset_index()
+        statement.columns.name = None
+        return statement
 
     def balance_sheet_calculator(self):
         """Retrieve balance sheet related data through relevant tags and calculate additional statistics."""
-        # balance sheet tags
-        tags = {"CashAndCashEquivalentsAtCarryingValue": ['Cash', "USD"],
-                "InventoryNet": ['Inventory', "USD"],
-                "AssetsCurrent": ['Current Assets', "USD"],
-                "AssetsNoncurrent": ['Non-Current Assets', "USD"],
-                "DebtCurrent": ['Current Debt', "USD"],
-                "AccountsPayableCurrent": ['Accounts Payable', "USD"],
-                "DeferredRevenueCurrent": ['Deferred Revenue', "USD"],
-                "LiabilitiesCurrent": ['Current Liabilities', "USD"],
-                "LongTermDebt": ['Long-term Debt', "USD"],
-                "LiabilitiesNoncurrent": ['Non Current Liabilities', "USD"],
-                "Liabilities": ['Liabilities', "USD"],
-                "IntangibleAssetsNetExcludingGoodwill": ['Intangible Assets', "USD"],
-                "Goodwill": ['Goodwill', "USD"],
-                }
         # get data and merge it together into a single dataframe
-        balance = self.merge_records(tags)
-        # need to do additional important balance sheet calculations
-        # use 'all' to check if the columns exist first to avoid errors
-        if all(x in balance.columns for x in ['Liabilities', 'Current Liabilities']):
-            balance['Non Current Liabilities'] = balance['Liabilities'] - balance['Current Liabilities']
-        if all(x in balance.columns for x in ['Current Assets', 'Non-Current Assets']):
-            balance['Assets'] = balance["Current Assets"] + balance["Non-Current Assets"]
-        if all(x in balance.columns for x in ['Assets', 'Liabilities']):
-            balance['Stockholders Equity(BV)'] = balance['Assets'] - balance['Liabilities']
-        if all(x in balance.columns for x in ['Assets', 'Intangible Assets', 'Goodwill']):
-            balance['Tangible Assets'] = balance['Assets'] - balance["Intangible Assets"] - balance["Goodwill"]
-        if all(x in balance.columns for x in ['Tangible Assets', 'Liabilities']):
-            balance['Tangible BV'] = balance["Tangible Assets"] - balance['Liabilities']
+        balance = self.merge_records(BALANCE_SHEET_TAGS)
+        # need to do additional important balance sheet calculations, see the metrics registered in metrics.py
+        balance = compute_metrics(balance, "Balance Sheet")
         return balance
 
     def income_statement_calculator(self):
         """Retrieve income statement related data through relevant tags and calculate additional statistics."""
-        # income statement tags
-        tags = {"Revenues": ['Revenue', "USD"],
-                "CostOfGoodsAndServicesSold": ['COGS', "USD"],
-                "GrossProfit": ['Gross Profit', "USD"],
-                "ResearchAndDevelopmentExpense": ['R&D', "USD"],
-                "SellingGeneralAndAdministrativeExpense": ['SGA', "USD"],
-                "DepreciationDepletionAndAmortization": ['D&A', "USD"],
-                "InterestExpense": ['Interest Expense', "USD"],
-                "DirectTaxesAndLicensesCosts": ['Tax', "USD"],
-                "EarningsPerShareBasic": ['Basic EPS', "USD/shares"],
-                "EarningsPerShareDiluted": ['Diluted EPS', "USD/shares"],
-                "NetIncomeLoss": ['Net Income', "USD"]}
         # get data and merge it together into a single dataframe
-        income = self.merge_records(tags)
+        income = self.merge_records(INCOME_STATEMENT_TAGS)
         # calculate revenue (+3-year average) incase it does not exist above, earnings, and margins
-        # use 'all' to check if the columns exist first to avoid errors
-        if all(x in income.columns for x in ['Gross Profit', 'COGS']):
-            income['Revenue'] = income['Gross Profit'] + income['COGS']
-        if all(x in income.columns for x in ['Revenue']):
-            income['Revenue Avg3'] = income['Revenue'].rolling(3).apply(lambda x: x.mean())
-        if all(x in income.columns for x in ['Gross Profit', 'Revenue']):
-            income['Gross Margin(%)'] = ((income['Gross Profit'] / income['Revenue']) * 100).round(1)
-        if all(x in income.columns for x in ['R&D', 'SGA']):
-            income['Operating expense'] = income['R&D'] + income['SGA']
-        if all(x in income.columns for x in ['Gross Profit', 'Operating expense']):
-            income['EBIT'] = income['Gross Profit'] - income['Operating expense']
-        if all(x in income.columns for x in ['EBIT', 'D&A']):
-            income['EBITDA'] = income['EBIT'] + income['D&A']
-        if all(x in income.columns for x in ['R&D', 'Revenue']):
-            income['R&D Margin(%)'] = ((income['R&D'] / income['Revenue']) * 100).round(1)
-        if all(x in income.columns for x in ['SGA', 'Revenue']):
-            income['SGA Margin(%)'] = ((income['SGA'] / income['Revenue']) * 100).round(1)
-        if all(x in income.columns for x in ['EBIT', 'Revenue']):
-            income['EBIT Margin(%)'] = ((income['EBIT'] / income['Revenue']) * 100).round(1)
-        if all(x in income.columns for x in ['EBITDA', 'Revenue']):
-            income['EBITDA Margin(%)'] = ((income['EBITDA'] / income['Revenue']) * 100).round(1)
-        if all(x in income.columns for x in ['Net Income', 'Revenue']):
-            income['Net Income Margin(%)'] = ((income['Net Income'] / income['Revenue']) * 100).round(1)
+        income = compute_metrics(income, "Income Statement")
         return income
 
     def cashflow_calculator(self):
         """Retrieve cashflow related data through relevant tags and calculate additional statistics."""
-        # cashflow tags
-        tags = {"NetCashProvidedByUsedInOperatingActivities": ['CFO', "USD"],
-                "NetCashProvidedByUsedInInvestingActivities": ['CFI', "USD"],
-                "NetCashProvidedByUsedInFinancingActivities": ['CFF', "USD"],
-                "PaymentsOfDividends": ['Dividends', "USD"],
-                "RepaymentsOfDebt": ["Debt Repayment", "USD"],
-                "PaymentsForRepurchaseOfCommonStock": ["Common Stock Repurchased", "USD"],
-                "PaymentsToAcquirePropertyPlantAndEquipment": ['CapEx', "USD"],
-                }
         # get data and merge it together into a single dataframe
-        cashflow = self.merge_records(tags)
+        cashflow = self.merge_records(CASHFLOW_TAGS)
         # calculate net cash flow, free cash flow and the 3-year average operating cashflow
-        # use 'all' to check if the columns exist first to avoid errors
-        if all(x in cashflow.columns for x in ['CFO', 'CFI', 'CFF']):
-            cashflow["NCF"] = cashflow["CFO"] + cashflow["CFI"] + cashflow["CFF"]
-        if all(x in cashflow.columns for x in ['CFO', 'CapEx']):
-            cashflow["FCF"] = cashflow["CFO"] - cashflow["CapEx"]
-        if all(x in cashflow.columns for x in ['CFO']):
-            cashflow['CFO Avg3'] = cashflow['CFO'].rolling(3).apply(lambda x: x.mean())
+        cashflow = compute_metrics(cashflow, "Cashflow Statement")
         return cashflow
 
     def other_statistics(self):
         """A function to retrieve other key information."""
-        outstanding_shares = self.tag_data("CommonStockSharesOutstanding", 'Outstanding Shares', units="shares")
+        outstanding_shares = self.tag_data("CommonStockSharesOutstanding", *OTHER_TAGS["CommonStockSharesOutstanding"])
         columns = ["Period End", "Outstanding Shares"]
         return outstanding_shares[columns]
 
+    @instrumentation.timed("sec_fetch", "ticker")
+    def fetch(self, ticker):
+        """Set the ticker and request its data, the company facts or every tag from the companyconcept endpoint."""
+        self.set_ticker(ticker)
+        self.prefetch([*INCOME_STATEMENT_TAGS, *BALANCE_SHEET_TAGS, *CASHFLOW_TAGS, *OTHER_TAGS])
+
+    @instrumentation.timed("statements", "ticker")
     def financial_statements(self, ticker):
         """Combine the financial statements."""
-        self.set_ticker(ticker)
+        self.fetch(ticker)
         # retrieve income statement, balance sheet and cashflow data
         income = self.income_statement_calculator()
         balance = self.balance_sheet_calculator()
@@ -181,23 +226,21 @@ class SECDataRetriever:
         # use try statement to avoid errors in case the data does not exist
         try:
             stats = self.other_statistics()
-        except:
+        except Exception as error:
+            self.errors["CommonStockSharesOutstanding"] = repr(error)
+            instrumentation.count("missing_tags_total", tag="CommonStockSharesOutstanding")
             stats = pd.DataFrame({"Period End": []})
         # add the stats(outstanding shares) to each financial statement
         income = income.merge(stats, left_on='Period End', right_on='Period End', how='left')
         balance = balance.merge(stats, left_on='Period End', right_on='Period End', how='left')
         cashflow = cashflow.merge(stats, left_on='Period End', right_on='Period End', how='left')
         # make additional calculations where data from other dataframes is required
-        if all(x in balance.columns for x in ['Stockholders Equity(BV)', 'Outstanding Shares']):
-            balance['BV/Share'] = (balance['Stockholders Equity(BV)'] / balance['Outstanding Shares']).round(1)
-        if all(x in balance.columns for x in ['Tangible BV', 'Outstanding Shares']):
-            balance['TBV/Share'] = (balance['Tangible BV'] / balance['Outstanding Shares']).round(1)
-        # create a separate dataframe for additional calculations between cashflow and income statements
-        df = cashflow.merge(income, left_on='Period End', right_on='Period End', how='left')
-        if all(x in df.columns for x in ['CFO', 'Revenue']):
-            cashflow['CFO Margin(%)'] = ((df['CFO'] / df['Revenue']) * 100).round(1)
-        if all(x in df.columns for x in ['NCF', 'Revenue']):
-            cashflow['NCF Margin(%)'] = ((df['NCF'] / df['Revenue']) * 100).round(1)
-        if all(x in df.columns for x in ['FCF', 'Revenue']):
-            cashflow['FCF Margin(%)'] = ((df['FCF'] / df['Revenue']) * 100).round(1)
+        balance = compute_metrics(balance, "Balance Sheet", overwrite=False)
+        # bring in the income statement columns used by the cashflow metrics, aligned on the period end
+        needed = [x for metric in METRICS["Cashflow Statement"].values() for x in metric.inputs
+                  if x not in cashflow.columns and x in income.columns]
+        needed = list(dict.fromkeys(needed))
+        cashflow = cashflow.merge(income[["Period End", *needed]].drop_duplicates("Period End"),
+                                  left_on='Period End', right_on='Period End', how='left')
+        cashflow = compute_metrics(cashflow, "Cashflow Statement", overwrite=False).drop(columns=needed)
         return income, balance, cashflow
@@ -0,0 +1,178 @@
+import cProfile
+import functools
+import inspect
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# upper bounds of the histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+
+class Instrumentation:
+    """
+    Collects the spans (timed stages of the pipeline), counters and histograms of a process.
+    Snapshots of worker processes can be merged in, and everything can be exported to JSON lines
+    or to a Prometheus style text file.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()  # requests are counted from the fetching threads
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+            self.counters = {}  # (name, labels) to value
+            self.histograms = {}  # (name, labels) to [count per bucket, count, sum]
+
+    @staticmethod
+    def key(name, labels):
+        """The key of a counter or histogram. Label values are kept as text like Prometheus does,
+        so keys with e.g. a status code and a status text can be sorted together."""
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def count(self, name, value=1, **labels):
+        """Add the value to a counter."""
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Add a measurement (in seconds) to a histogram."""
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.setdefault(key, [[0] * len(BUCKETS), 0, 0.0])
+            histogram[0][next(index for index, bound in enumerate(BUCKETS) if value <= bound)] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the code within the span. The duration goes to the <name>_seconds histogram,
+        and the span is kept with its labels (e.g. the ticker) for the JSON lines export."""
+        start = time.time()
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - began
+            self.observe(name + "_seconds", seconds)
+            with self.lock:
+                self.spans.append({"name": name, "labels": labels, "start": start, "seconds": seconds})
+
+    def timed(self, name, *labels):
+        """Decorator recording every call of the function as a span, labelled with the named arguments, e.g.
+        @instrumentation.timed("join_market_data", "ticker")."""
+        def decorator(function):
+            signature = inspect.signature(function)
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                arguments = signature.bind(*args, **kwargs).arguments
+                with self.span(name, **{label: arguments[label] for label in labels}):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """Return everything collected as a picklable dictionary, e.g. to send it from a worker process."""
+        with self.lock:
+            return {"spans": list(self.spans), "counters": dict(self.counters),
+                    "histograms": {key: [list(value[0]), value[1], value[2]] for key, value in self.histograms.items()}}
+
+    def merge(self, snapshot):
+        """Add a snapshot of another process to the collected data."""
+        with self.lock:
+            self.spans.extend(snapshot["spans"])
+            for key, value in snapshot["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (buckets, count, total) in snapshot["histograms"].items():
+                histogram = self.histograms.setdefault(key, [[0] * len(BUCKETS), 0, 0.0])
+                histogram[0] = [a + b for a, b in zip(histogram[0], buckets)]
+                histogram[1] += count
+                histogram[2] += total
+
+    def cache_hit_rate(self):
+        """The share of cached requests served without downloading the body again, None without cached requests."""
+        results = {dict(labels)["result"]: value for (name, labels), value in self.counters.items()
+                   if name == "cache_requests_total"}
+        total = sum(results.values())
+        return (results.get("hit", 0) + results.get("revalidated", 0)) / total if total else None
+
+    def export_jsonl(self, path):
+        """Write every span, counter and histogram as a line of json."""
+        snapshot = self.snapshot()
+        with open(path, "w") as file:
+            for span in snapshot["spans"]:
+                file.write(json.dumps({"type": "span", **span}) + "\n")
+            for (name, labels), value in snapshot["counters"].items():
+                file.write(json.dumps({"type": "counter", "name": name, "labels": dict(labels), "value": value}) + "\n")
+            for (name, labels), (buckets, count, total) in snapshot["histograms"].items():
+                file.write(json.dumps({"type": "histogram", "name": name, "labels": dict(labels), "count": count,
+                                       "sum": total, "buckets": dict(zip(map(str, BUCKETS), buckets))}) + "\n")
+
+    def export_prometheus(self, path):
+        """Write the counters and histograms in the Prometheus text format."""
+        def label_text(labels):
+            return "{" + ",".join(key + '="' + str(value) + '"' for key, value in labels) + "}" if labels else ""
+        snapshot = self.snapshot()
+        lines = []
+        for name in sorted({name for name, _ in snapshot["counters"]}):
+            lines.append("# TYPE " + name + " counter")
+            for (counter, labels), value in sorted(snapshot["counters"].items()):
+                if counter == name:
+                    lines.append(name + label_text(labels) + " " + str(value))
+        for name in sorted({name for name, _ in snapshot["histograms"]}):
+            lines.append("# TYPE " + name + " histogram")
+            for (histogram, labels), (buckets, count, total) in sorted(snapshot["histograms"].items()):
+                if histogram != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS, buckets):
+                    cumulative += bucket
+                    le = "+Inf" if bound == float("inf") else str(bound)
+                    lines.append(name + "_bucket" + label_text(labels + (("le", le),)) + " " + str(cumulative))
+                lines.append(name + "_sum" + label_text(labels) + " " + str(total))
+                lines.append(name + "_count" + label_text(labels) + " " + str(count))
+        with open(path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+
+    def export(self, path):
+        """Export to JSON lines when the path ends with .jsonl, otherwise to the Prometheus text format."""
+        if path.endswith(".jsonl"):
+            self.export_jsonl(path)
+        else:
+            self.export_prometheus(path)
+
+
+# a single instrumentation per process which every part of the pipeline reports to
+instrumentation = Instrumentation()
+
+
+def profile(function, *args, stats_path=None, top=20, **kwargs):
+    """
+    Run the function with cProfile and tracemalloc, e.g. the pipeline of a single ticker, and print the functions
+    taking the most time and the lines allocating the most memory. The cProfile stats are saved to stats_path when given.
+    """
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profiler.disable()
+        peak = tracemalloc.get_traced_memory()[1]
+        allocations = tracemalloc.take_snapshot().statistics("lineno")[:top]
+        tracemalloc.stop()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(top)
+        print(output.getvalue())
+        print("Peak memory: " + str(round(peak / 1024 ** 2, 1)) + " MB")
+        for allocation in allocations:
+            print(allocation)
+        if stats_path:
+            profiler.dump_stats(stats_path)
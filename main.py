@@ -1,20 +1,26 @@
 from financial_data import SECDataRetriever
 from market_data import join_market_data
+from price_store import PriceStore
+from response_cache import ResponseCache
 from excel_dashboard import stock_dashboard_generator
 
 
 def main():
     """
     Main function takes in email and ticker as input and saves the respective spreadsheet in the
-    dashboard folder.
+    dashboard folder. SEC responses are cached in the cache folder and prices are kept in the prices folder,
+    so running the same ticker again needs no network.
     """
     print("Please enter email to access SEC api.")
     email = input()
     print("Please enter ticker.")
     ticker = input()
-    call = SECDataRetriever(email)
+    cache = ResponseCache()
+    call = SECDataRetriever(email, cache=cache)
     income, balance, cashflow = call.financial_statements(ticker)
-    income, balance, cashflow = join_market_data(ticker, income, balance, cashflow)
+    for tag in call.errors:
+        print(tag+" Failed!")
+    income, balance, cashflow = join_market_data(ticker, income, balance, cashflow, PriceStore())
     stock_dashboard_generator(ticker, income, balance, cashflow)
 
 
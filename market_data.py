@@ -1,15 +1,15 @@
-import yfinance as yf
+import pandas as pd
 
+from instrumentation import instrumentation
+from price_store import YahooPriceSource, month_keys
 
-def price_history(ticker):
-    # get historical market data from yahoo finance
-    tick = yf.Ticker(ticker)
-    hist = tick.history(period='max', interval='1mo')
-    hist = hist.reset_index()
-    hist = hist.astype({'Date': 'str'})
-    hist['Month End'] = hist["Date"].str.slice(0, 7)
-    hist['Price'] = hist['Close'].round(2)
-    return hist[['Price', 'Month End']]
+
+def price_history(ticker, store=None):
+    # get historical monthly prices from the local price store, or straight from yahoo finance without one
+    if store is not None:
+        return store.prices(ticker)
+    hist = YahooPriceSource().monthly_closes(ticker)
+    return pd.DataFrame({'Month Key': month_keys(hist['Date']), 'Price': hist['Close'].round(2)})
 
 
 def format_date(df):
@@ -20,15 +20,16 @@ def format_date(df):
     return df
 
 
-def join_market_data(ticker, income, balance, cashflow):
-    history = price_history(ticker)  # get historical data
-    # join the data on the year and month
-    income['Month End'] = income['Period End'].str.slice(0, 7)
-    income = income.merge(history, left_on='Month End', right_on='Month End', how='left')
-    balance['Month End'] = balance['Period End'].str.slice(0, 7)
-    balance = balance.merge(history, left_on='Month End', right_on='Month End', how='left')
-    cashflow['Month End'] = cashflow['Period End'].str.slice(0, 7)
-    cashflow = cashflow.merge(history, left_on='Month End', right_on='Month End', how='left')
+@instrumentation.timed("join_market_data", "ticker")
+def join_market_data(ticker, income, balance, cashflow, store=None):
+    history = price_history(ticker, store)  # get historical data
+    # join the data on the integer year and month key
+    income['Month Key'] = month_keys(income['Period End'])
+    income = income.merge(history, left_on='Month Key', right_on='Month Key', how='left')
+    balance['Month Key'] = month_keys(balance['Period End'])
+    balance = balance.merge(history, left_on='Month Key', right_on='Month Key', how='left')
+    cashflow['Month Key'] = month_keys(cashflow['Period End'])
+    cashflow = cashflow.merge(history, left_on='Month Key', right_on='Month Key', how='left')
     # use price data to calculate yearly market cap
     if all(x in income.columns for x in ['Price', 'Outstanding Shares']):
         income['Market Cap'] = income['Price'] * income['Outstanding Shares']
@@ -0,0 +1,137 @@
+import pandas as pd
+
+
+class Metric:
+    """
+    A derived statistic of a financial statement, declared with the columns it needs and a formula which computes it
+    from a dataframe of the statement with vectorized operations.
+    """
+    def __init__(self, name, statement, inputs, formula):
+        self.name = name
+        self.statement = statement
+        self.inputs = inputs
+        self.formula = formula
+
+
+# every registered metric per statement, in the order they were registered
+METRICS = {"Income Statement": {}, "Balance Sheet": {}, "Cashflow Statement": {}}
+
+
+def register_metric(name, statement, inputs, formula):
+    """Add a metric to a statement, or replace the metric with the same name. The formula takes the statement
+    dataframe (a single ticker, or a panel of tickers with a Ticker column) and returns the metric as a series."""
+    METRICS[statement][name] = Metric(name, statement, inputs, formula)
+
+
+def rolling_mean(column, window):
+    """Formula of the rolling mean of a column, computed separately for each ticker of a panel."""
+    def formula(df):
+        if "Ticker" in df.columns:
+            return df.groupby("Ticker", sort=False)[column].rolling(window).mean().reset_index(level=0, drop=True)
+        return df[column].rolling(window).mean()
+    return formula
+
+
+def margin(column):
+    """Formula of a column as a percentage of the revenue."""
+    return lambda df: ((df[column] / df['Revenue']) * 100).round(1)
+
+
+def ratio(numerator, denominator):
+    """Formula of one column divided by another."""
+    return lambda df: (df[numerator] / df[denominator]).round(1)
+
+
+def evaluation_order(statement):
+    """Resolve the dependencies between the metrics of a statement, so each metric comes after the metrics it uses.
+    Raises ValueError when the metrics depend on each other in a cycle."""
+    metrics = METRICS[statement]
+    order = []
+    visiting = set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError("Metrics of the " + statement + " depend on each other: " + name)
+        visiting.add(name)
+        for column in metrics[name].inputs:
+            if column in metrics and column != name:
+                visit(column)
+        visiting.remove(name)
+        order.append(name)
+
+    for name in metrics:
+        visit(name)
+    return [metrics[name] for name in order]
+
+
+def compute_metrics(df, statement, overwrite=True):
+    """
+    Calculate the metrics of the statement on the dataframe, in dependency order. Metrics with a missing input column
+    are skipped, and in a panel the rows of tickers which do not report an input keep their existing value.
+    With overwrite False only the metrics which are not columns of the dataframe yet are calculated.
+    """
+    df = df.copy()
+    for metric in evaluation_order(statement):
+        if not overwrite and metric.name in df.columns:
+            continue
+        if not all(x in df.columns for x in metric.inputs):
+            continue
+        result = metric.formula(df)
+        if metric.name in df.columns:
+            # only replace the values of tickers which report every input
+            if "Ticker" in df.columns:
+                reported = df.groupby("Ticker", sort=False)[metric.inputs].transform("count").gt(0).all(axis=1)
+            else:
+                reported = pd.Series(df[metric.inputs].count().gt(0).all(), index=df.index)
+            result = result.where(reported, df[metric.name])
+        df[metric.name] = result
+    return df
+
+
+def panel(statements, statement):
+    """Stack the dataframes of many tickers ({ticker: dataframe}) into a single panel with a Ticker column,
+    and calculate the metrics of the statement over all of them at once."""
+    df = pd.concat([data.assign(Ticker=ticker) for ticker, data in statements.items()], ignore_index=True)
+    df = df.sort_values(["Ticker", "Period End"], kind="stable", ignore_index=True)
+    return compute_metrics(df, statement)
+
+
+# income statement: revenue (+3-year average) incase it does not exist, earnings, and margins
+register_metric('Revenue', "Income Statement", ['Gross Profit', 'COGS'], lambda df: df['Gross Profit'] + df['COGS'])
+register_metric('Revenue Avg3', "Income Statement", ['Revenue'], rolling_mean('Revenue', 3))
+register_metric('Gross Margin(%)', "Income Statement", ['Gross Profit', 'Revenue'], margin('Gross Profit'))
+register_metric('Operating expense', "Income Statement", ['R&D', 'SGA'], lambda df: df['R&D'] + df['SGA'])
+register_metric('EBIT', "Income Statement", ['Gross Profit', 'Operating expense'],
+                lambda df: df['Gross Profit'] - df['Operating expense'])
+register_metric('EBITDA', "Income Statement", ['EBIT', 'D&A'], lambda df: df['EBIT'] + df['D&A'])
+register_metric('R&D Margin(%)', "Income Statement", ['R&D', 'Revenue'], margin('R&D'))
+register_metric('SGA Margin(%)', "Income Statement", ['SGA', 'Revenue'], margin('SGA'))
+register_metric('EBIT Margin(%)', "Income Statement", ['EBIT', 'Revenue'], margin('EBIT'))
+register_metric('EBITDA Margin(%)', "Income Statement", ['EBITDA', 'Revenue'], margin('EBITDA'))
+register_metric('Net Income Margin(%)', "Income Statement", ['Net Income', 'Revenue'], margin('Net Income'))
+
+# balance sheet
+register_metric('Non Current Liabilities', "Balance Sheet", ['Liabilities', 'Current Liabilities'],
+                lambda df: df['Liabilities'] - df['Current Liabilities'])
+register_metric('Assets', "Balance Sheet", ['Current Assets', 'Non-Current Assets'],
+                lambda df: df["Current Assets"] + df["Non-Current Assets"])
+register_metric('Stockholders Equity(BV)', "Balance Sheet", ['Assets', 'Liabilities'],
+                lambda df: df['Assets'] - df['Liabilities'])
+register_metric('Tangible Assets', "Balance Sheet", ['Assets', 'Intangible Assets', 'Goodwill'],
+                lambda df: df['Assets'] - df["Intangible Assets"] - df["Goodwill"])
+register_metric('Tangible BV', "Balance Sheet", ['Tangible Assets', 'Liabilities'],
+                lambda df: df["Tangible Assets"] - df['Liabilities'])
+register_metric('BV/Share', "Balance Sheet", ['Stockholders Equity(BV)', 'Outstanding Shares'],
+                ratio('Stockholders Equity(BV)', 'Outstanding Shares'))
+register_metric('TBV/Share', "Balance Sheet", ['Tangible BV', 'Outstanding Shares'],
+                ratio('Tangible BV', 'Outstanding Shares'))
+
+# cashflow: net cash flow, free cash flow, the 3-year average operating cashflow and margins
+register_metric("NCF", "Cashflow Statement", ['CFO', 'CFI', 'CFF'], lambda df: df["CFO"] + df["CFI"] + df["CFF"])
+register_metric("FCF", "Cashflow Statement", ['CFO', 'CapEx'], lambda df: df["CFO"] - df["CapEx"])
+register_metric('CFO Avg3', "Cashflow Statement", ['CFO'], rolling_mean('CFO', 3))
+register_metric('CFO Margin(%)', "Cashflow Statement", ['CFO', 'Revenue'], margin('CFO'))
+register_metric('NCF Margin(%)', "Cashflow Statement", ['NCF', 'Revenue'], margin('NCF'))
+register_metric('FCF Margin(%)', "Cashflow Statement", ['FCF', 'Revenue'], margin('FCF'))
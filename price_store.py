@@ -0,0 +1,101 @@
+import os
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+# a monthly close per row, the month as an integer year*100+month
+PRICE_DTYPE = np.dtype([("month", "<i4"), ("close", "<f8")])
+
+
+def month_keys(dates):
+    """Turn a series of dates into integer year*100+month keys."""
+    dates = pd.to_datetime(dates)
+    return (dates.dt.year * 100 + dates.dt.month).astype("int64")
+
+
+class PriceSource(ABC):
+    """A source of monthly closing prices. Sources return a dataframe with a Date and a Close column."""
+    @abstractmethod
+    def monthly_closes(self, ticker, start=None):
+        """Return the monthly closes of the ticker, from the month of start (a date string) when given."""
+
+
+class YahooPriceSource(PriceSource):
+    """Monthly closes from yahoo finance."""
+    def monthly_closes(self, ticker, start=None):
+        tick = yf.Ticker(ticker)
+        if start is None:
+            hist = tick.history(period='max', interval='1mo')
+        else:
+            hist = tick.history(start=start, interval='1mo')
+        return hist.reset_index()[['Date', 'Close']]
+
+
+class FixturePriceSource(PriceSource):
+    """Monthly closes read from <directory>/<ticker>.csv files with Date and Close columns, e.g. for tests."""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def monthly_closes(self, ticker, start=None):
+        hist = pd.read_csv(os.path.join(self.directory, ticker + ".csv"))
+        if start is not None:
+            hist = hist.loc[month_keys(hist['Date']) >= month_keys(pd.Series([start]))[0]]
+        return hist[['Date', 'Close']]
+
+
+class PriceStore:
+    """
+    A local store of monthly closing prices with a memory-mapped numpy file per ticker.
+    On an update only the months from the last stored month onwards are requested from the source
+    (the last month is requested again as it may not have been complete). Files updated less than max_age
+    seconds ago are used as they are, and in offline mode only the stored prices are used.
+    """
+    def __init__(self, directory="prices", source=None, max_age=24 * 60 * 60, offline=False):
+        self.directory = directory
+        self.source = source or YahooPriceSource()
+        self.max_age = max_age
+        self.offline = offline
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, ticker):
+        return os.path.join(self.directory, ticker + ".npy")
+
+    def load(self, ticker):
+        """Return the stored prices of the ticker as a memory-mapped array (empty when nothing is stored)."""
+        if not os.path.exists(self.path(ticker)):
+            return np.empty(0, dtype=PRICE_DTYPE)
+        return np.load(self.path(ticker), mmap_mode='r')
+
+    def update(self, ticker):
+        """Request the months after the last stored month from the source and add them to the store."""
+        stored = self.load(ticker)
+        start = None
+        if len(stored):
+            last = int(stored["month"][-1])
+            start = str(last // 100) + "-" + str(last % 100).zfill(2) + "-01"
+        hist = self.source.monthly_closes(ticker, start).dropna(subset=['Close'])
+        new = np.empty(len(hist), dtype=PRICE_DTYPE)
+        new["month"] = month_keys(hist['Date']).to_numpy()
+        new["close"] = hist['Close'].round(2).to_numpy()
+        # keep the stored months before the new data, the new data replaces everything after that
+        prices = np.concatenate([stored[stored["month"] < new["month"].min()] if len(new) else stored, new])
+        # sort by month and keep the last close of each month
+        if len(prices):  # nothing stored and no rows from the source, e.g. a delisted ticker
+            prices = prices[np.argsort(prices["month"], kind="stable")]
+            prices = prices[np.append(prices["month"][1:] != prices["month"][:-1], True)]
+        temporary = self.path(ticker) + "." + str(os.getpid()) + ".npy"
+        np.save(temporary, prices)
+        os.replace(temporary, self.path(ticker))  # never leave a partially written file behind
+        return self.load(ticker)
+
+    def prices(self, ticker):
+        """Return the monthly prices of the ticker, updating the store first when it is out of date."""
+        path = self.path(ticker)
+        if self.offline or (os.path.exists(path) and time.time() - os.path.getmtime(path) < self.max_age):
+            prices = self.load(ticker)
+        else:
+            prices = self.update(ticker)
+        return pd.DataFrame({'Month Key': prices["month"].astype("int64"), 'Price': prices["close"]})
@@ -0,0 +1,155 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+
+from batch import completed_tickers, run_batch
+from financial_data import DATA_URL, TICKERS_URL, SECDataRetriever
+from response_cache import ResponseCache
+
+ANNUAL_FORMS = {"10-K", "10-K/A"}  # filings which change the annual statements
+
+
+def load_state(path):
+    """Read the tracked tickers and the annual filings seen at the last refresh of each ticker."""
+    if not os.path.exists(path):
+        return {"tracked": [], "filings": {}}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_state(path, state):
+    """Write the tracked tickers with their annual filings."""
+    temporary = path + "." + str(os.getpid())
+    with open(temporary, "w") as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+    os.replace(temporary, path)  # never leave a partially written state behind
+
+
+def annual_filings(submissions):
+    """Return the accession numbers of the annual filings in a submissions response, with their forms and filing
+    dates."""
+    recent = submissions["filings"]["recent"]
+    return {accession: (form, filed) for form, accession, filed in
+            zip(recent["form"], recent["accessionNumber"], recent["filingDate"]) if form in ANNUAL_FORMS}
+
+
+def new_filings(retriever, tickers, state):
+    """
+    Request the submissions of the tickers concurrently and return the tickers with annual filings which were not
+    seen at their last refresh, with all their annual filings and the latest 10-K among them.
+    Tickers which were never refreshed count as new.
+    """
+    urls = {}
+    for ticker in tickers:
+        # look the cik up in the mapping, set_ticker would request the company facts
+        cik = retriever.tickers_cik.loc[retriever.tickers_cik.index == ticker, "cik_str"]
+        if len(cik) != 1:
+            print(ticker + " is not in company_tickers.json, skipped.")
+            continue
+        urls[retriever.data_url + "/submissions/CIK" + cik.item() + ".json"] = ticker
+    changed = {}
+    for url, result in retriever.session.fetch_many(urls).items():
+        ticker = urls[url]
+        if isinstance(result, Exception):
+            print(ticker + " submissions failed: " + repr(result))
+            continue
+        filings = annual_filings(result)
+        seen = set(state["filings"].get(ticker, {}).get("accessions", []))
+        if ticker not in state["filings"] or set(filings) - seen:
+            reports = [(filed, accession) for accession, (form, filed) in filings.items() if form == "10-K"]
+            changed[ticker] = {"cik": url.split("/CIK")[1][:10], "accessions": sorted(filings),
+                               "filed": max((filed for _, filed in filings.values()), default=None),
+                               "latest": max(reports)[1] if reports else None}
+    return changed
+
+
+def checkpoint_path(state_path, changed):
+    """
+    The checkpoint of a refresh of the changed tickers. It is named after the filings being processed,
+    so an interrupted refresh resumes from it, while a later refresh which has to process other filings starts
+    from an empty checkpoint. Checkpoints of other filings are removed.
+    """
+    digest = hashlib.sha1(json.dumps(changed, sort_keys=True).encode()).hexdigest()[:16]
+    checkpoint = state_path + "." + digest + ".checkpoint.jsonl"
+    for stale in glob.glob(glob.escape(state_path) + ".*.checkpoint.jsonl"):
+        if stale != checkpoint:
+            os.remove(stale)
+    return checkpoint
+
+
+def in_company_facts(retriever, filings):
+    """
+    Check that the company facts contain the latest 10-K of the filings, as the companyfacts api can lag behind
+    the submissions feed. The facts were just requested by the batch workers, so they are read from the cache.
+    Amendments are not checked, they do not always contain facts.
+    """
+    if filings["latest"] is None:
+        return True
+    try:
+        facts = retriever.session.get_json(retriever.data_url + "/api/xbrl/companyfacts/CIK" + filings["cik"] +
+                                           ".json")
+    except Exception as error:
+        print("Company facts of CIK" + filings["cik"] + " failed: " + repr(error))
+        return False
+    return any(record.get("accn") == filings["latest"] for concept in facts["facts"].get("us-gaap", {}).values()
+               for records in concept["units"].values() for record in records)
+
+
+def refresh(email, tickers=None, state_path="refresh_state.json", workers=4, cache_directory="cache",
+            prices_directory="prices", screener_directory=None, metrics=None, sec_urls=(TICKERS_URL, DATA_URL)):
+    """
+    Recompute only the tickers with new annual filings since their last refresh. The tickers default to every
+    tracked ticker in the state file, and given tickers are tracked from then on, even when they fail.
+    Their cached SEC responses are marked stale so the new facts are requested, then the batch pipeline recreates
+    their statements, dashboards and screener rows. The filings of a ticker are only saved once it has been
+    recomputed from company facts which contain its latest 10-K, so an interrupted refresh, or one which ran before
+    the company facts were updated, picks up the same tickers again.
+    """
+    state = load_state(state_path)
+    cache = ResponseCache(cache_directory)
+    retriever = SECDataRetriever(email, cache=cache, tickers_url=sec_urls[0], data_url=sec_urls[1])
+    tickers = list(tickers or state["tracked"])
+    state["tracked"] = sorted(set(state["tracked"]) | set(tickers))
+    save_state(state_path, state)
+    changed = new_filings(retriever, tickers, state)
+    print(str(len(changed)) + " of " + str(len(tickers)) + " tickers have new annual filings.")
+    if not changed:
+        return {}
+    for ticker, filings in changed.items():
+        # the cached facts of the company are out of date now
+        cache.expire(sec_urls[1] + "/api/xbrl/companyfacts/CIK" + filings["cik"])
+        cache.expire(sec_urls[1] + "/api/xbrl/companyconcept/CIK" + filings["cik"] + "/")
+    checkpoint = checkpoint_path(state_path, changed)
+    run_batch(email, list(changed), workers, checkpoint, cache_directory, prices_directory, metrics=metrics,
+              screener_directory=screener_directory, sec_urls=sec_urls)
+    for ticker in completed_tickers(checkpoint) & set(changed):
+        if in_company_facts(retriever, changed[ticker]):
+            state["filings"][ticker] = changed[ticker]
+        else:
+            print(ticker + " was recomputed before its company facts contain " + changed[ticker]["latest"] +
+                  ", it stays pending.")
+    save_state(state_path, state)
+    # the run finished, failed and pending tickers have to be recomputed by the next refresh
+    os.remove(checkpoint)
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute the tickers with new annual filings.")
+    parser.add_argument("email", help="email to access SEC api")
+    parser.add_argument("tickers", nargs="*", help="tickers to track, every tracked ticker when left out")
+    parser.add_argument("--state", default="refresh_state.json",
+                        help="file with the tracked tickers and the filings seen per ticker")
+    parser.add_argument("--workers", type=int, default=4, help="number of worker processes")
+    parser.add_argument("--cache", default="cache", help="response cache folder")
+    parser.add_argument("--prices", default="prices", help="price store folder")
+    parser.add_argument("--screener", help="folder of the screener table to update")
+    parser.add_argument("--metrics", help="export the instrumentation of the recomputed tickers")
+    args = parser.parse_args()
+    refresh(args.email, args.tickers, args.state, args.workers, args.cache, args.prices, args.screener, args.metrics)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+DAY = 24 * 60 * 60
+
+# how long a response stays fresh before it is revalidated, matched on the longest url prefix
+DEFAULT_TTLS = {"https://www.sec.gov/files/company_tickers.json": DAY,
+                "https://data.sec.gov/api/xbrl/": 7 * DAY,  # annual filings only change a few times a year
+                }
+
+
+class OfflineCacheMiss(LookupError):
+    """Raised in offline mode when a response is not in the cache."""
+
+
+class ResponseCache:
+    """
+    A persistent on-disk cache of responses keyed by url.
+    The bodies are stored as separate files and an sqlite index keeps their validators (ETag/Last-Modified),
+    when they were fetched and last used. Entries older than the TTL of their endpoint are revalidated,
+    and the least recently used entries are evicted when the cache grows beyond max_bytes.
+    In offline mode every response is served from the cache, whatever its age.
+    """
+    def __init__(self, directory="cache", ttls=None, max_bytes=2 * 1024 ** 3, offline=False):
+        self.directory = directory
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.max_bytes = max_bytes
+        self.offline = offline
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()  # the connection is shared between the fetching threads
+        self.index = sqlite3.connect(os.path.join(directory, "index.sqlite"), timeout=60, check_same_thread=False)
+        self.index.execute("CREATE TABLE IF NOT EXISTS entries (url TEXT PRIMARY KEY, file TEXT, etag TEXT, "
+                           "last_modified TEXT, fetched REAL, accessed REAL, size INTEGER)")
+        self.index.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.index.commit()
+
+    def ttl(self, url):
+        """Return the time to live of the url, using the longest matching prefix (0 when none match)."""
+        prefixes = [prefix for prefix in self.ttls if url.startswith(prefix)]
+        return self.ttls[max(prefixes, key=len)] if prefixes else 0
+
+    def path(self, file):
+        return os.path.join(self.directory, file)
+
+    def lookup(self, url):
+        """Return the cached entry of the url as a dictionary, or None when it is not cached.
+        'fresh' tells whether the entry is still within its TTL."""
+        with self.lock:
+            row = self.index.execute("SELECT file, etag, last_modified, fetched FROM entries WHERE url = ?",
+                                     (url,)).fetchone()
+            if row is None:
+                return None
+            try:
+                with open(self.path(row[0]), "rb") as file:
+                    body = file.read()
+            except FileNotFoundError:
+                # the body was removed by another process, forget the entry
+                self.index.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self.index.commit()
+                return None
+            now = time.time()
+            self.index.execute("UPDATE entries SET accessed = ? WHERE url = ?", (now, url))
+            self.index.commit()
+        return {"body": body, "etag": row[1], "last_modified": row[2],
+                "fresh": now - row[3] < self.ttl(url)}
+
+    def validators(self, entry):
+        """The headers of a conditional request for a cached entry."""
+        headers = {}
+        if entry is not None and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url, body, etag=None, last_modified=None):
+        """Save the body of the url and evict the least recently used entries if the cache is too large."""
+        file = hashlib.sha1(url.encode()).hexdigest()
+        temporary = self.path(file + "." + str(os.getpid()) + "." + str(threading.get_ident()))
+        with open(temporary, "wb") as output:
+            output.write(body)
+        os.replace(temporary, self.path(file))  # never leave a partially written body behind
+        now = time.time()
+        with self.lock:
+            self.index.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (url, file, etag, last_modified, now, now, len(body)))
+            self.index.commit()
+        self.evict()
+
+    def touch(self, url):
+        """Mark the entry as fresh again after the server confirmed it has not changed (304)."""
+        now = time.time()
+        with self.lock:
+            self.index.execute("UPDATE entries SET fetched = ?, accessed = ? WHERE url = ?", (now, now, url))
+            self.index.commit()
+
+    def expire(self, prefix):
+        """Make the entries whose url starts with the prefix stale, so they are revalidated on their next request."""
+        with self.lock:
+            self.index.execute("UPDATE entries SET fetched = 0 WHERE substr(url, 1, ?) = ?", (len(prefix), prefix))
+            self.index.commit()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes."""
+        with self.lock:
+            total = self.index.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for url, file, size in self.index.execute("SELECT url, file, size FROM entries ORDER BY accessed").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.index.execute("DELETE FROM entries WHERE url = ?", (url,))
+                try:
+                    os.remove(self.path(file))
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self.index.commit()
@@ -0,0 +1,167 @@
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+
+def fundamentals(ticker, income, balance, cashflow):
+    """Combine the statements of a ticker (as returned by join_market_data) into a row per year
+    with every statement field and derived metric as a column."""
+    # a year can have two period ends when the fiscal year end changed, keep the later one
+    frames = [df.loc[~df.index.duplicated(keep="last")].drop(columns=["Source", "Month Key"], errors="ignore")
+              for df in [income, balance, cashflow]]
+    # period end, price, shares and market cap are in every statement, take them from any statement with the year
+    df = pd.concat(frames, axis=1)
+    shared = {column: df[column].bfill(axis=1).iloc[:, 0] for column in df.columns[df.columns.duplicated()].unique()}
+    df = df.loc[:, ~df.columns.duplicated()].assign(**shared).reset_index()
+    df.insert(0, "Ticker", ticker)
+    df["Year"] = df["Year"].astype(int)
+    return df
+
+
+class Screener:
+    """
+    A column-oriented table of the fundamentals of every ticker and year for cross-sectional screens.
+    The table is kept in an sqlite store in the directory, a row per ticker, year and field indexed by ticker,
+    so refreshing a ticker only replaces its own rows and tickers with different fields share one schema.
+    The table is loaded once into memory as a column per field, where the queries are evaluated vectorized
+    over all tickers. Sorted indexes per metric are built when first used for ranks and ranges,
+    and dropped when the table changes.
+    """
+    def __init__(self, directory="fundamentals"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # worker processes update the store at the same time, wait for each other's writes
+        self.connection = sqlite3.connect(os.path.join(directory, "fundamentals.sqlite"), timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")  # a crash loses at most the last tickers, not the store
+        self.connection.execute("CREATE TABLE IF NOT EXISTS fundamentals (ticker TEXT, year INTEGER, "
+                                "period_end TEXT, field TEXT, value REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS fundamentals_ticker ON fundamentals (ticker)")
+        self.connection.commit()
+        self.data = None
+        self.indexes = {}  # (metric, year) to the sorted values and their tickers
+
+    @property
+    def table(self):
+        """Every ticker and year, sorted by ticker and year. Loaded from the store when first used."""
+        if self.data is None:
+            self.reload()
+        return self.data
+
+    def reload(self):
+        """Load the table again from the store, e.g. after other processes updated tickers."""
+        rows = pd.read_sql("SELECT ticker AS Ticker, year AS Year, period_end AS 'Period End', field, value "
+                           "FROM fundamentals", self.connection)
+        data = rows.pivot(index=["Ticker", "Year", "Period End"], columns="field", values="value")
+        data.columns.name = None
+        self.data = data.reset_index().sort_values(["Ticker", "Year"], ignore_index=True)
+        self.indexes = {}
+
+    def update(self, ticker, income, balance, cashflow):
+        """Store the fundamentals of a refreshed ticker, replacing its previous rows."""
+        df = fundamentals(ticker, income, balance, cashflow)
+        fields = [column for column in df.columns if column not in ("Ticker", "Year", "Period End")]
+        values = df[fields].astype(float)
+        rows = [(ticker, int(year), period_end, field, None if pd.isna(value) else float(value))
+                for year, period_end, row in zip(df["Year"], df["Period End"], values.itertuples(index=False))
+                for field, value in zip(fields, row)]
+        with self.connection:  # replace the rows of the ticker in a single transaction
+            self.connection.execute("DELETE FROM fundamentals WHERE ticker = ?", (ticker,))
+            self.connection.executemany("INSERT INTO fundamentals VALUES (?, ?, ?, ?, ?)", rows)
+        if self.data is not None:
+            # replace the rows of the ticker in the loaded table instead of loading everything again
+            rest = self.data.loc[self.data["Ticker"] != ticker]
+            self.data = pd.concat([rest, df], ignore_index=True).sort_values(["Ticker", "Year"], ignore_index=True)
+            self.indexes = {}
+
+    def remove(self, ticker):
+        """Remove a ticker from the table."""
+        with self.connection:
+            self.connection.execute("DELETE FROM fundamentals WHERE ticker = ?", (ticker,))
+        if self.data is not None:
+            self.data = self.data.loc[self.data["Ticker"] != ticker].reset_index(drop=True)
+            self.indexes = {}
+
+    def latest(self, year=None):
+        """A row per ticker: the given year, or the latest year each ticker reported."""
+        table = self.table
+        if year is not None:
+            return table.loc[table["Year"] == year].set_index("Ticker")
+        return table.groupby("Ticker", sort=False).tail(1).set_index("Ticker")
+
+    def rising(self, metric, years=1, year=None):
+        """Tickers whose metric rose in each of the last number of years (up to the given year)."""
+        table = self.table if year is None else self.table.loc[self.table["Year"] <= year]
+        if metric not in table.columns:
+            return pd.Index([], name="Ticker")
+        # the change of the metric in each of the last years of every ticker, missing changes do not count as a rise
+        rise = table.groupby("Ticker", sort=False)[metric].diff() > 0
+        rose = rise.groupby(table["Ticker"], sort=False).tail(years).groupby(table["Ticker"], sort=False).all()
+        enough = table.groupby("Ticker", sort=False).size() > years
+        return rose.index[rose & enough]
+
+    def index(self, metric, year=None):
+        """The values of the metric sorted ascending with the matching tickers, without missing values."""
+        key = (metric, year)
+        if key not in self.indexes:
+            values = self.latest(year)[metric].dropna()
+            order = np.argsort(values.to_numpy(), kind="stable")
+            self.indexes[key] = (values.to_numpy()[order], values.index.to_numpy()[order])
+        return self.indexes[key]
+
+    def between(self, metric, low=-np.inf, high=np.inf, year=None):
+        """Tickers with the metric between low and high (inclusive), found with a binary search on the index."""
+        values, tickers = self.index(metric, year)
+        return pd.Index(tickers[np.searchsorted(values, low, "left"):np.searchsorted(values, high, "right")],
+                        name="Ticker")
+
+    def top(self, metric, n=10, year=None, ascending=False):
+        """The n tickers with the highest (or lowest) metric, with their value."""
+        values, tickers = self.index(metric, year)
+        if not ascending:
+            values, tickers = values[::-1], tickers[::-1]
+        return pd.Series(values[:n], index=pd.Index(tickers[:n], name="Ticker"), name=metric)
+
+    def percentile(self, metric, year=None):
+        """The percentile rank (0-100) of every ticker for the metric."""
+        values, tickers = self.index(metric, year)
+        ranks = np.searchsorted(values, values, "right") / len(values) * 100 if len(values) else values
+        return pd.Series(ranks, index=pd.Index(tickers, name="Ticker"), name=metric)
+
+    def screen(self, where=None, rising=(), year=None, rising_years=1):
+        """
+        A row per ticker (latest or given year) matching the pandas query in where, e.g. "`FCF Margin(%)` > 20",
+        and whose metrics in rising went up over the last rising_years years.
+        """
+        df = self.latest(year)
+        if where:
+            df = df.query(where)
+        for metric in rising:
+            df = df.loc[df.index.isin(self.rising(metric, rising_years, year))]
+        return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Screen the fundamentals of every ticker.")
+    parser.add_argument("--directory", default="fundamentals", help="folder of the screener table")
+    parser.add_argument("--where", help='pandas query, e.g. "`FCF Margin(%%)` > 20"')
+    parser.add_argument("--rising", action="append", default=[], help="metric which has to be rising")
+    parser.add_argument("--rising-years", type=int, default=1, help="number of years the metrics have to rise")
+    parser.add_argument("--year", type=int, help="year to screen instead of the latest year of each ticker")
+    parser.add_argument("--sort", help="metric to sort the results on, highest first")
+    parser.add_argument("--limit", type=int, default=50, help="number of results to show")
+    args = parser.parse_args()
+    screener = Screener(args.directory)
+    results = screener.screen(args.where, args.rising, args.year, args.rising_years)
+    if args.sort:
+        results = results.sort_values(args.sort, ascending=False)
+    columns = ["Year"] + [column for column in [args.sort] + args.rising if column]
+    print(str(len(results)) + " tickers match.")
+    print(results[list(dict.fromkeys(columns))].head(args.limit).to_string())
+
+
+if __name__ == '__main__':
+    main()
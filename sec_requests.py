@@ -0,0 +1,149 @@
+import json
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import instrumentation
+from response_cache import OfflineCacheMiss
+
+REQUESTS_PER_SECOND = 8  # the SEC allows at most 10 requests per second, keep some headroom
+RETRY_STATUS = {429, 500, 502, 503, 504}  # throttled or temporary server errors worth retrying
+
+
+class RateLimiter:
+    """
+    A token bucket. Tokens refill at the given rate up to the burst size,
+    and each request has to take one token before it is sent.
+    A shared limiter keeps its state in shared memory, so worker processes started with it stay under the rate together.
+    """
+    def __init__(self, rate=REQUESTS_PER_SECOND, burst=1, shared=False):
+        self.rate = rate
+        self.burst = burst
+        if shared:
+            self.lock = multiprocessing.Lock()
+            self.state = multiprocessing.Array('d', [burst, time.monotonic()], lock=False)
+        else:
+            self.lock = threading.Lock()
+            self.state = [burst, time.monotonic()]  # tokens available and when they were last refilled
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                tokens = min(self.burst, self.state[0] + (now - self.state[1]) * self.rate)
+                self.state[1] = now
+                if tokens >= 1:
+                    self.state[0] = tokens - 1
+                    return
+                self.state[0] = tokens
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+
+# a single limiter per process so every session stays under the SEC limit together
+sec_rate_limiter = RateLimiter()
+
+
+def set_rate_limiter(limiter):
+    """Replace the limiter used by default by every session, e.g. with a shared one in a worker process."""
+    global sec_rate_limiter
+    sec_rate_limiter = limiter
+
+
+def endpoint_labels(url):
+    """The labels of the http metrics of a url: its SEC endpoint, and the tag for companyconcept requests."""
+    path = url.split("?")[0]
+    if "/api/xbrl/companyconcept/" in path:
+        return {"endpoint": "companyconcept", "tag": path.rsplit("/", 1)[-1][:-len(".json")]}
+    for endpoint in ["companyfacts", "submissions", "company_tickers"]:
+        if "/" + endpoint in path:
+            return {"endpoint": endpoint}
+    return {"endpoint": "other"}
+
+
+class SECSession:
+    """
+    Pooled HTTP session for the SEC api. Connections are kept alive and shared between threads,
+    every request goes through the rate limiter and throttled or failed requests are retried with backoff.
+    With a ResponseCache the json responses are served from disk while fresh and revalidated with conditional requests.
+    """
+    def __init__(self, email, max_workers=8, limiter=None, retries=4, backoff=0.5, timeout=30, cache=None):
+        self.header = {'User-Agent': email}  # email required to use sec api
+        self.max_workers = max_workers
+        self.limiter = limiter or sec_rate_limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.session = requests.Session()
+        self.session.headers.update(self.header)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url, headers=None):
+        """Request the url, retrying 429/5xx responses and connection errors with exponential backoff.
+        The latency, bytes and status of every attempt are recorded per endpoint (and tag, see endpoint_labels)."""
+        labels = endpoint_labels(url)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                instrumentation.count("http_retries_total", **labels)
+            self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.ConnectionError:
+                instrumentation.count("http_requests_total", status="connection error", **labels)
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+            instrumentation.observe("http_request_seconds", time.perf_counter() - start, **labels)
+            instrumentation.count("http_requests_total", status=response.status_code, **labels)
+            instrumentation.count("http_bytes_total", len(response.content), **labels)
+            if response.status_code == 429:
+                instrumentation.count("http_throttled_total", **labels)
+            if response.status_code in RETRY_STATUS and attempt < self.retries:
+                # respect the wait time given by the server when there is one
+                retry_after = response.headers.get("Retry-After", "")
+                delay = float(retry_after) if retry_after.isdigit() else self.backoff * 2 ** attempt
+                time.sleep(delay)
+                continue
+            response.raise_for_status()
+            return response
+
+    def get_json(self, url):
+        """Request the url and return the decoded json, using the cache when there is one."""
+        if self.cache is None:
+            return self.get(url).json()
+        entry = self.cache.lookup(url)
+        if entry is not None and (entry["fresh"] or self.cache.offline):
+            instrumentation.count("cache_requests_total", result="hit")
+            return json.loads(entry["body"])
+        if self.cache.offline:
+            instrumentation.count("cache_requests_total", result="offline miss")
+            raise OfflineCacheMiss(url)
+        response = self.get(url, headers=self.cache.validators(entry))
+        if response.status_code == 304:  # not modified, the cached body is still valid
+            instrumentation.count("cache_requests_total", result="revalidated")
+            self.cache.touch(url)
+            return json.loads(entry["body"])
+        instrumentation.count("cache_requests_total", result="miss")
+        self.cache.store(url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return response.json()
+
+    def fetch_many(self, urls):
+        """Request the urls concurrently. Returns a dictionary of url to its json, or to the exception raised for it."""
+        def fetch(url):
+            try:
+                return self.get_json(url)
+            except Exception as error:
+                return error
+        urls = list(urls)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return dict(zip(urls, pool.map(fetch, urls)))
@@ -0,0 +1,47 @@
+import json
+import zipfile
+
+import pytest
+from pandas.testing import assert_frame_equal
+
+from benchmarks.fixtures import SyntheticFixtures, synthetic_company
+from benchmarks.server import StandInServer
+from facts_store import FactsStore
+from financial_data import SECDataRetriever
+
+
+@pytest.fixture
+def store(tmp_path):
+    """A facts store ingested from a small synthetic companyfacts.zip with a damaged member."""
+    archive_path = tmp_path / "companyfacts.zip"
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        for number in range(2):
+            cik = 1000000 + number
+            archive.writestr("CIK" + str(cik).zfill(10) + ".json", json.dumps(synthetic_company(cik, number)))
+        archive.writestr("CIK0001000002.json", '{"cik": 1000002, "facts": {"us-gaap": {')  # cut short
+        archive.writestr("README.txt", "not a company")
+    store = FactsStore(str(tmp_path / "facts.sqlite"))
+    assert store.ingest(str(archive_path)) == 2
+    return store
+
+
+def test_ingest_keeps_the_facts_of_every_company(store):
+    for number in range(2):
+        facts = synthetic_company(1000000 + number, number)["facts"]["us-gaap"]
+        assert store.company_facts(str(1000000 + number).zfill(10)) == \
+            {tag: {"units": concept["units"]} for tag, concept in facts.items()}  # the labels are not stored
+    with pytest.raises(KeyError):
+        store.company_facts("0001000002")  # the damaged member is skipped
+
+
+def test_statements_from_the_store_match_the_api(store):
+    with StandInServer(SyntheticFixtures(2)) as server:
+        urls = {"tickers_url": server.url + "/files/company_tickers.json", "data_url": server.url}
+        from_store = SECDataRetriever("test@example.com", store=store, **urls)
+        from_api = SECDataRetriever("test@example.com", **urls)
+        requests = server.requests
+        statements = from_store.financial_statements("T00001")
+        assert server.requests == requests  # only the ticker mapping is requested
+        for df, expected in zip(statements, from_api.financial_statements("T00001")):
+            assert_frame_equal(df, expected)
+        assert from_store.errors.keys() == from_api.errors.keys()  # the tags the company does not report
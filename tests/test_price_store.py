@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from price_store import PriceSource, PriceStore
+
+
+class ListPriceSource(PriceSource):
+    """Returns the given closes, from the month of start when given, and records the requested starts."""
+    def __init__(self, dates, closes):
+        self.hist = pd.DataFrame({"Date": dates, "Close": closes})
+        self.starts = []
+
+    def monthly_closes(self, ticker, start=None):
+        self.starts.append(start)
+        if start is None:
+            return self.hist
+        return self.hist.loc[pd.to_datetime(self.hist["Date"]) >= pd.Timestamp(start)]
+
+
+def test_update_requests_only_the_months_after_the_stored_ones(tmp_path):
+    source = ListPriceSource(["2020-01-01", "2020-02-01", "2020-02-15"], [1.0, 2.0, 2.5])
+    store = PriceStore(str(tmp_path), source, max_age=0)
+    assert store.prices("T").to_dict("list") == {"Month Key": [202001, 202002], "Price": [1.0, 2.5]}
+    source.hist = pd.DataFrame({"Date": ["2020-01-01", "2020-02-01", "2020-03-01"], "Close": [9.0, 3.0, 4.0]})
+    assert store.prices("T").to_dict("list") == {"Month Key": [202001, 202002, 202003], "Price": [1.0, 3.0, 4.0]}
+    assert source.starts == [None, "2020-02-01"]
+
+
+def test_no_prices_from_the_source(tmp_path):
+    # e.g. a delisted ticker, or only missing closes
+    for source in [ListPriceSource([], []), ListPriceSource(["2020-01-01"], [np.nan])]:
+        store = PriceStore(str(tmp_path), source, max_age=0)
+        assert len(store.prices("T")) == 0
+        assert len(store.update("T")) == 0
+    # stored prices are kept when the source has nothing new
+    store = PriceStore(str(tmp_path), ListPriceSource(["2020-01-01"], [1.0]), max_age=0)
+    store.update("T")
+    store.source = ListPriceSource([], [])
+    assert store.prices("T").to_dict("list") == {"Month Key": [202001], "Price": [1.0]}
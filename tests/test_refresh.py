@@ -0,0 +1,129 @@
+import json
+import os
+
+import pytest
+
+import refresh
+from benchmarks.fixtures import LAST_YEAR, SyntheticFixtures, synthetic_company, synthetic_submissions
+from benchmarks.server import StandInPriceSource, StandInServer
+from price_store import PriceStore
+from screener import Screener
+
+TICKERS = ["T00000", "T00001", "T00002"]
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """A stand-in server with the responses of three synthetic tickers, as a dictionary the tests can change."""
+    monkeypatch.chdir(tmp_path)  # the dashboards are written to the working directory
+    os.makedirs("dashboards")
+    synthetic = SyntheticFixtures(len(TICKERS))
+    fixtures = {"/files/company_tickers.json": synthetic.get("/files/company_tickers.json")}
+    for number in range(len(TICKERS)):
+        cik = "CIK" + str(1000000 + number).zfill(10)
+        for path in ["/api/xbrl/companyfacts/" + cik + ".json", "/submissions/" + cik + ".json",
+                     "/prices/" + TICKERS[number] + ".csv"]:
+            fixtures[path] = synthetic.get(path)
+    with StandInServer(fixtures) as server:
+        # store the prices up front, the batch workers then use them instead of requesting yahoo finance
+        store = PriceStore("prices", StandInPriceSource(server.url))
+        for ticker in TICKERS:
+            store.prices(ticker)
+        yield server
+
+
+@pytest.fixture
+def processed(monkeypatch):
+    """The tickers recomputed by each batch run of a refresh."""
+    runs = []
+    run_batch = refresh.run_batch
+
+    def recorded(*args, **kwargs):
+        results = run_batch(*args, **kwargs)
+        runs.append(sorted(result["ticker"] for result in results))
+        return results
+    monkeypatch.setattr(refresh, "run_batch", recorded)
+    return runs
+
+
+def run(server, tickers=None):
+    return refresh.refresh("test@example.com", tickers, workers=2, screener_directory="fundamentals",
+                           sec_urls=(server.url + "/files/company_tickers.json", server.url))
+
+
+def file_new_10k(server, number, facts=True):
+    """Add the 10-K of the next year to the submissions of the ticker, and to its company facts unless they lag."""
+    cik = "CIK" + str(1000000 + number).zfill(10)
+    server.fixtures["/submissions/" + cik + ".json"] = json.dumps(
+        synthetic_submissions(1000000 + number, LAST_YEAR + 1)).encode()
+    if facts:
+        server.fixtures["/api/xbrl/companyfacts/" + cik + ".json"] = json.dumps(
+            synthetic_company(1000000 + number, number, LAST_YEAR + 1)).encode()
+
+
+def test_only_new_and_changed_tickers_are_recomputed(server, processed):
+    assert sorted(run(server, TICKERS[:2])) == TICKERS[:2]  # not refreshed before
+    assert run(server) == {}  # nothing filed since
+    file_new_10k(server, 1)
+    assert list(run(server)) == ["T00001"]
+    assert sorted(run(server, ["T00001", "T00002"])) == ["T00002"]  # a new ticker, T00001 is unchanged
+    assert processed == [TICKERS[:2], ["T00001"], ["T00002"]]
+    state = refresh.load_state("refresh_state.json")
+    assert state["tracked"] == TICKERS
+    assert max(state["filings"]["T00001"]["accessions"]) == "0001000001-" + str(LAST_YEAR + 2)[2:] + "-000001"
+    assert list(Screener("fundamentals").latest().index) == TICKERS  # written by the worker processes
+
+
+def test_failed_tickers_stay_tracked_and_are_retried(server, processed):
+    facts = server.fixtures.pop("/api/xbrl/companyfacts/CIK0001000001.json")
+    run(server, TICKERS[:2])
+    state = refresh.load_state("refresh_state.json")
+    assert state["tracked"] == TICKERS[:2]
+    assert list(state["filings"]) == ["T00000"]
+    # the daily run picks the failed ticker up again, without the one completed before
+    server.fixtures["/api/xbrl/companyfacts/CIK0001000001.json"] = facts
+    assert list(run(server)) == ["T00001"]
+    assert processed == [TICKERS[:2], ["T00001"]]
+    assert not [name for name in os.listdir() if name.endswith(".checkpoint.jsonl")]
+
+
+def test_tickers_stay_pending_while_the_company_facts_lag(server, processed):
+    run(server, TICKERS[:1])
+    # the 10-K is in the submissions feed before the company facts are updated
+    file_new_10k(server, 0, facts=False)
+    assert list(run(server)) == ["T00000"]
+    latest = "0001000000-" + str(LAST_YEAR + 2)[2:] + "-000001"
+    assert latest not in refresh.load_state("refresh_state.json")["filings"]["T00000"]["accessions"]
+    file_new_10k(server, 0)
+    assert list(run(server)) == ["T00000"]
+    assert processed == [["T00000"], ["T00000"], ["T00000"]]
+    assert refresh.load_state("refresh_state.json")["filings"]["T00000"]["latest"] == latest
+    assert run(server) == {}
+
+
+def test_interrupted_refresh_resumes_only_for_the_same_filings(server, processed, monkeypatch):
+    recorded = refresh.run_batch
+
+    def interrupted(*args, **kwargs):
+        recorded(*args, **kwargs)
+        raise KeyboardInterrupt  # stopped after the tickers were recomputed, before the state was saved
+    monkeypatch.setattr(refresh, "run_batch", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run(server, TICKERS[:2])
+    assert refresh.load_state("refresh_state.json") == {"tracked": TICKERS[:2], "filings": {}}
+    # a new 10-K of T00000 is not skipped because of the checkpoint left behind
+    file_new_10k(server, 0)
+    monkeypatch.setattr(refresh, "run_batch", recorded)
+    assert sorted(run(server)) == TICKERS[:2]
+    # with the same filings an interrupted refresh resumes from its checkpoint
+    file_new_10k(server, 1)
+    monkeypatch.setattr(refresh, "run_batch", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run(server)
+    monkeypatch.setattr(refresh, "run_batch", recorded)
+    assert list(run(server)) == ["T00001"]
+    assert processed == [TICKERS[:2], TICKERS[:2], ["T00001"], []]
+    filings = refresh.load_state("refresh_state.json")["filings"]
+    assert [max(filings[ticker]["accessions"]) for ticker in TICKERS[:2]] == \
+        [str(1000000 + number).zfill(10) + "-" + str(LAST_YEAR + 2)[2:] + "-000001" for number in range(2)]
+    assert not [name for name in os.listdir() if name.endswith(".checkpoint.jsonl")]
@@ -0,0 +1,42 @@
+import pandas as pd
+
+from market_data import format_date
+from screener import Screener, fundamentals
+
+
+def statement(period_ends, **columns):
+    return format_date(pd.DataFrame({"Period End": period_ends, **columns}))
+
+
+def test_fundamentals_of_a_year_missing_from_the_income_statement():
+    income = statement(["2022-12-31"], Revenue=[10.0], Price=[5.0], **{"Market Cap": [50.0]})
+    balance = statement(["2021-12-31", "2022-12-31"], Cash=[1.0, 2.0], Price=[4.0, 5.0],
+                        **{"Market Cap": [40.0, 50.0]})
+    cashflow = statement(["2022-12-31"], CFO=[3.0], Price=[5.0], **{"Market Cap": [50.0]})
+    df = fundamentals("T", income, balance, cashflow)
+    assert list(df.columns) == ["Ticker", "Year", "Period End", "Revenue", "Price", "Market Cap", "Cash", "CFO"]
+    assert df.set_index("Year")[["Price", "Market Cap", "Cash"]].to_dict("index") == \
+        {2021: {"Price": 4.0, "Market Cap": 40.0, "Cash": 1.0}, 2022: {"Price": 5.0, "Market Cap": 50.0, "Cash": 2.0}}
+
+
+def test_fundamentals_keep_the_later_period_end_of_a_year():
+    # the fiscal year end changed from june to december
+    frames = [statement(["2019-06-30", "2019-12-31", "2020-12-31"], Revenue=[1.0, 2.0, 3.0]),
+              statement(["2019-06-30", "2019-12-31", "2020-12-31"], Cash=[1.0, 2.0, 3.0]),
+              statement(["2019-12-31", "2020-12-31"], CFO=[2.0, 3.0])]
+    df = fundamentals("T", *frames)
+    assert df[["Year", "Period End", "Revenue", "Cash", "CFO"]].values.tolist() == \
+        [[2019, "12-31", 2.0, 2.0, 2.0], [2020, "12-31", 3.0, 3.0, 3.0]]
+
+
+def test_screen_over_stored_tickers(tmp_path):
+    screener = Screener(str(tmp_path))
+    for ticker, revenues in {"A": [1.0, 2.0, 3.0], "B": [3.0, 2.0, 1.0], "C": [1.0, 1.5, 5.0]}.items():
+        income = statement(["2020-12-31", "2021-12-31", "2022-12-31"], Revenue=revenues)
+        screener.update(ticker, income, statement(["2022-12-31"], Cash=[1.0]), statement(["2022-12-31"], CFO=[1.0]))
+    screener = Screener(str(tmp_path))  # load the table from the stored files
+    assert list(screener.screen("Revenue > 2", rising=["Revenue"], rising_years=2).index) == ["A", "C"]
+    assert screener.top("Revenue", 2).to_dict() == {"C": 5.0, "A": 3.0}
+    assert list(screener.between("Revenue", 2, 4, year=2021)) == ["A", "B"]
+    screener.remove("C")
+    assert list(Screener(str(tmp_path)).latest().index) == ["A", "B"]